@@ -9,6 +9,8 @@ import json
 import requests
 import time
 
+from response_parser import parse_response
+
 
 class PoemFlowerAnalyzer:
     """
@@ -138,32 +140,13 @@ class PoemFlowerAnalyzer:
         if not json_text:
             return self.get_default_result()
 
-        try:
-            #直接解析
-            return json.loads(json_text)
-        except json.JSONDecodeError:
-            try:
-                #第一次解析失败，清理后解析
-                cleaned_text = json_text.strip()
-
-                # 检查JSON对象是否是完整的
-                if cleaned_text.startswith('{') and cleaned_text.endswith('}'):
-                    return json.loads(cleaned_text)
-                else:
-                    #提取JSON部分
-                    start_index = cleaned_text.find('{')
-                    end_index = cleaned_text.rfind('}') + 1
-
-                    if start_index != -1 and end_index != 0:
-                        json_str = cleaned_text[start_index:end_index]
-                        return json.loads(json_str)
-                    else:
-                        # 无有效的JSON
-                        raise ValueError("无有效的JSON")
-            except Exception as e:
-                print(f"JSON解析失败: {e}")
-                print(f"原始文本: {json_text}")
-                return self.get_default_result()
+        # 与 json_poem_analyzer 共用的解析器(截取花括号 + 修复常见格式问题)
+        result, category = parse_response(json_text)
+        if result is None:
+            print(f"JSON解析失败: {category}")
+            print(f"原始文本: {json_text}")
+            return self.get_default_result()
+        return result
 
     def get_default_result(self):
         """
@@ -0,0 +1,166 @@
+"""
+离线批量任务
+将 DataLoader 输出的诗词写成分片的 JSONL 批量请求文件(每行一个请求，custom_id 为 poem_id)，
+批量结果返回后再逐行读入，经 _clean_response / _standardize_result 写入分析结果
+"""
+
+import glob
+import json
+import os
+
+from poem_records import PoemRecord
+
+
+MANIFEST_FILE = 'batch_manifest.jsonl'
+
+
+class BatchJobWriter:
+    """生成批量请求文件"""
+
+    def __init__(self, analyzer, output_dir='batch_jobs', shard_size=10000):
+        self.analyzer = analyzer
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    def write(self, poems):
+        """
+        写出请求分片与清单(清单记录 poem_id 对应的标题、作者等，回收结果时使用)
+        Returns:
+            请求文件路径列表
+        """
+        request_files = []
+        request_file = None
+        manifest_path = os.path.join(self.output_dir, MANIFEST_FILE)
+
+        with open(manifest_path, 'w', encoding='utf-8') as manifest:
+            for i, poem in enumerate(poems):
+                if i % self.shard_size == 0:
+                    if request_file:
+                        request_file.close()
+                    path = os.path.join(self.output_dir, f'batch_requests_{len(request_files):05d}.jsonl')
+                    request_files.append(path)
+                    request_file = open(path, 'w', encoding='utf-8')
+
+                prompt = self.analyzer._build_analysis_prompt(poem.content)
+                request = {
+                    'custom_id': poem.poem_id,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': self.analyzer._build_request_body(prompt)
+                }
+                request_file.write(json.dumps(request, ensure_ascii=False) + '\n')
+                manifest.write(json.dumps({
+                    'poem_id': poem.poem_id,
+                    'title': poem.title,
+                    'author': poem.author,
+                    'source_file': poem.source_file,
+                    'index': poem.index,
+                    'rhythmic': poem.rhythmic,
+                    'content_hash': poem.content_hash
+                }, ensure_ascii=False) + '\n')
+
+        if request_file:
+            request_file.close()
+        print(f"已生成 {len(request_files)} 个批量请求文件 -> {self.output_dir}")
+        return request_files
+
+
+def load_manifest(job_dir):
+    """读取清单，poem_id -> PoemRecord(不含诗句)"""
+    poems = {}
+    with open(os.path.join(job_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        for line in f:
+            item = json.loads(line)
+            poems[item['poem_id']] = PoemRecord(item['title'], item['author'], '', item['source_file'],
+                                                item['index'], item.get('rhythmic'), item['content_hash'])
+    return poems
+
+
+class BatchIngester:
+    """回收批量结果文件"""
+
+    def __init__(self, analyzer, job_dir='batch_jobs'):
+        self.analyzer = analyzer
+        self.poems = load_manifest(job_dir)
+        self.failed_ids = []
+        # 已有结果的诗词(重复回收同一结果文件、在线重试已成功)跳过，不重复计入结果与消耗
+        self.analyzed = {r.poem_id for r in analyzer.analysis_results}
+        self.skipped = 0
+
+    def ingest(self, response_paths):
+        """
+        逐行读取结果文件并加入分析结果
+        Returns:
+            (成功数, 失败数)
+        """
+        success_count = 0
+        for path in response_paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    if self._ingest_line(json.loads(line)):
+                        success_count += 1
+
+        print(f"批量结果回收: 成功 {success_count} 条, 失败 {len(self.failed_ids)} 条, "
+              f"已有结果跳过 {self.skipped} 条")
+        return success_count, len(self.failed_ids)
+
+    def _ingest_line(self, item):
+        poem_id = item.get('custom_id')
+        if poem_id in self.analyzed:
+            self.skipped += 1
+            return False
+        poem = self.poems.get(poem_id)
+        response = item.get('response') or {}
+        if poem is None or response.get('status_code') != 200:
+            self.failed_ids.append(poem_id)
+            return False
+
+        body = response.get('body', {})
+        self.analyzer._record_usage(body.get('usage'))
+        try:
+            record = self.analyzer._record_from_completion(poem, body)
+        except (KeyError, IndexError, TypeError):
+            record = None
+        if record is None:
+            self.failed_ids.append(poem_id)
+            return False
+
+        self.analyzer.add_results([record])
+        self.analyzer.processed_count += 1
+        self.analyzed.add(poem_id)
+        return True
+
+
+def write_fake_responses(job_dir, response_dir=None):
+    """为本地测试生成假的批量结果文件(每个请求返回固定格式的 JSON)"""
+    response_dir = response_dir or os.path.join(job_dir, 'fake_responses')
+    if not os.path.exists(response_dir):
+        os.makedirs(response_dir)
+
+    response_files = []
+    for request_path in sorted(glob.glob(os.path.join(job_dir, 'batch_requests_*.jsonl'))):
+        name = os.path.basename(request_path).replace('batch_requests_', 'batch_responses_')
+        response_path = os.path.join(response_dir, name)
+        with open(request_path, 'r', encoding='utf-8') as src, \
+                open(response_path, 'w', encoding='utf-8') as dst:
+            for i, line in enumerate(src):
+                request = json.loads(line)
+                content = json.dumps({'date': 1000 + i % 300, 'flower': ['梅', '无', '菊'][i % 3],
+                                      'imagery': ['明月', '春风']}, ensure_ascii=False)
+                dst.write(json.dumps({
+                    'custom_id': request['custom_id'],
+                    'response': {
+                        'status_code': 200,
+                        'body': {
+                            'choices': [{'message': {'role': 'assistant',
+                                                     'content': f"```json\n{content}\n```"}}],
+                            'usage': {'prompt_tokens': 120, 'completion_tokens': 30, 'total_tokens': 150}
+                        }
+                    }
+                }, ensure_ascii=False) + '\n')
+        response_files.append(response_path)
+    return response_files
@@ -0,0 +1,130 @@
+"""
+宋词词牌索引与格律指纹
+扫描 ci.song.*.json，建立 词牌 -> 词作、格律指纹 -> 词作 的索引，
+指纹为(句数, 各句字数)，索引缓存到磁盘，文件未变化时无需重新扫描
+"""
+
+import glob
+import json
+import os
+import re
+from collections import defaultdict
+
+
+# 按标点与空白断句
+_LINE_BREAK = re.compile(r'[，。、？！；：,.?!;:\s]+')
+
+
+def metre_fingerprint(content):
+    """格律指纹: (句数, (各句字数...))"""
+    lengths = tuple(len(line) for line in _LINE_BREAK.split(content) if line)
+    return len(lengths), lengths
+
+
+def fingerprint_key(fingerprint):
+    """指纹的字符串形式，如 '6:7,7,7,7,7,7'"""
+    line_count, lengths = fingerprint
+    return f"{line_count}:{','.join(str(n) for n in lengths)}"
+
+
+class CiIndex:
+    """词牌与格律索引"""
+
+    def __init__(self, data_loader, cache_path='analysis_output/ci_index.json'):
+        self.data_loader = data_loader
+        self.cache_path = cache_path
+        self.poems = {}  # poem_id -> (词牌, 作者, 指纹键)
+        self.by_tune = defaultdict(list)
+        self.by_metre = defaultdict(list)
+
+    def _ci_files(self):
+        pattern = os.path.join(self.data_loader.data_dir, 'SongSongs', 'ci.song.*.json')
+        return sorted(glob.glob(pattern))
+
+    def build(self):
+        """建立索引，只重新扫描缓存后有变化的文件"""
+        cache = self._load_cache()
+        files = {}
+        rescanned = 0
+
+        for file_path in self._ci_files():
+            name = os.path.basename(file_path)
+            stat = os.stat(file_path)
+            signature = [stat.st_size, int(stat.st_mtime)]
+
+            cached = cache.get(name)
+            if cached and cached['signature'] == signature:
+                files[name] = cached
+                continue
+
+            entries = []
+            for poem in self.data_loader._load_from_file(file_path, 'full', 1.0, 0):
+                if poem.rhythmic:
+                    fingerprint = fingerprint_key(metre_fingerprint(poem.content))
+                    entries.append([poem.index, poem.rhythmic, poem.author, fingerprint])
+            files[name] = {'signature': signature, 'entries': entries}
+            rescanned += 1
+
+        if rescanned:
+            self._save_cache(files)
+
+        self.poems.clear()
+        self.by_tune.clear()
+        self.by_metre.clear()
+        for name, data in files.items():
+            for index, rhythmic, author, fingerprint in data['entries']:
+                poem_id = f"{name}#{index}"
+                self.poems[poem_id] = (rhythmic, author, fingerprint)
+                self.by_tune[rhythmic].append(poem_id)
+                self.by_metre[fingerprint].append(poem_id)
+
+        print(f"词牌索引: {len(self.poems)} 首词, {len(self.by_tune)} 个词牌, "
+              f"{len(self.by_metre)} 种格律 (重新扫描 {rescanned} 个文件)")
+        return self
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, files):
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(files, f, ensure_ascii=False)
+
+    def find(self, rhythmic, author=None):
+        """某词牌的全部词作，可按作者过滤，如 find('浣溪沙', '苏轼')"""
+        poem_ids = self.by_tune.get(rhythmic, [])
+        if author is None:
+            return list(poem_ids)
+        return [pid for pid in poem_ids if self.poems[pid][1] == author]
+
+    def same_metre(self, poem_id):
+        """与指定词作格律相同的全部词作"""
+        info = self.poems.get(poem_id)
+        if info is None:
+            return []
+        return list(self.by_metre[info[2]])
+
+    def find_metre(self, lengths):
+        """按各句字数查询，如 find_metre([7, 7, 7, 7, 7, 7])"""
+        return list(self.by_metre.get(fingerprint_key((len(lengths), tuple(lengths))), []))
+
+    def tune_of(self, poem_id):
+        info = self.poems.get(poem_id)
+        return info[0] if info else None
+
+    def group_by_tune(self, records):
+        """将分析结果按词牌分组(不再读取源文件)"""
+        groups = defaultdict(list)
+        for record in records:
+            rhythmic = self.tune_of(record.poem_id)
+            if rhythmic:
+                groups[rhythmic].append(record)
+        return groups
@@ -0,0 +1,174 @@
+"""
+增量刷新语料
+每个源文件记录(大小, 修改时间, sha1)指纹及文件内各诗 content_hash 的基线，每首诗的 content_hash 随分析结果保存；
+刷新时只重新加载指纹变化的文件，逐首比对 content_hash：
+不在基线中的诗(新增或文本改变)入队分析，文本改变或已删除的诗作废原有结果
+"""
+
+import hashlib
+import json
+import os
+
+from poem_records import AnalysisRecord
+
+
+FINGERPRINT_FILE = 'corpus_fingerprints.json'
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CorpusRefresher:
+    """比对语料与已保存的指纹"""
+
+    def __init__(self, analyzer, data_loader, output_dir='analysis_output'):
+        self.analyzer = analyzer
+        self.data_loader = data_loader
+        self.path = os.path.join(output_dir, FINGERPRINT_FILE)
+        self.files = self._load()
+        self.staged = {}  # 文件名 -> (新指纹, 待分析 poem_id 列表)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('files', {})
+
+    def save(self):
+        """写入指纹；仍有待分析诗词没有结果的文件保留旧指纹，下次刷新时重新比对"""
+        analyzed = {r.poem_id for r in self.analyzer.analysis_results}
+        deferred = 0
+        for name, (fingerprint, pending_ids) in self.staged.items():
+            if all(pid in analyzed for pid in pending_ids):
+                self.files[name] = fingerprint
+            else:
+                deferred += 1
+        if deferred:
+            print(f"{deferred} 个文件仍有未完成的诗词，下次刷新时继续")
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, ensure_ascii=False)  # 含全部诗的哈希基线，不缩进
+
+    def _changed_files(self):
+        """指纹变化(或首次出现)的源文件"""
+        changed = []
+        for db_name in self.data_loader.databases:
+            db_path = os.path.join(self.data_loader.data_dir, db_name)
+            if not os.path.exists(db_path):
+                continue
+            for file_path in self.data_loader._list_json_files(db_path):
+                name = os.path.basename(file_path)
+                stat = os.stat(file_path)
+                signature = [stat.st_size, int(stat.st_mtime)]
+                known = self.files.get(name)
+                if known and known['signature'] == signature:
+                    continue
+
+                # 修改时间变了但内容没变(如重新检出)，只更新指纹
+                sha1 = file_sha1(file_path)
+                if known and known['sha1'] == sha1:
+                    known['signature'] = signature
+                    continue
+                changed.append((file_path, name, signature, sha1))
+        return changed
+
+    @staticmethod
+    def _rebind(record, poem):
+        """已有结果改挂到新位置的诗词上(序号移动或旧版 标题_作者 键)"""
+        return AnalysisRecord(poem.poem_id, poem.title, poem.author, poem.source_file,
+                              record.date, record.flower, record.imagery, record.analysis_timestamp,
+                              record.method, poem.content_hash)
+
+    def _baseline(self, name, bootstrap):
+        """
+        文件上次刷新时各诗的 content_hash 集合；
+        None 表示没有基线(首次建立或旧版指纹)，此时只重新分析结果已作废的诗词
+        """
+        known = self.files.get(name)
+        if known is None:
+            return None if bootstrap else set()  # 新增的文件: 全部视为新诗
+        return set(known['hashes']) if 'hashes' in known else None
+
+    def refresh(self):
+        """
+        只有 content_hash 不在文件基线中的诗(新增或文本已改变)入队；
+        没有指纹文件时只建立基线: 旧结果改挂到新ID，不把从未分析过的诗词入队(由 --mode resume 处理)
+        Returns:
+            (需分析的 PoemRecord 列表, 变动的结果数)
+        """
+        bootstrap = not self.files
+        changed = self._changed_files()
+        changed_names = {name for _, name, _, _ in changed}
+        results = self.analyzer.analysis_results
+        by_id = {r.poem_id: r for r in results}
+
+        # 第一遍: 同一ID且文本未变(旧结果没有 content_hash 时无法比对，视为未变)
+        claimed = set()  # 已对应到诗词的结果的原 poem_id
+        unmatched = []
+        hashes = {}  # 文件名 -> 本次各诗的 content_hash
+        for file_path, name, signature, sha1 in changed:
+            baseline = self._baseline(name, bootstrap)
+            hashes[name] = set()
+            for poem in self.data_loader._load_from_file(file_path, 'full', 1.0, 0):
+                hashes[name].add(poem.content_hash)
+                record = by_id.get(poem.poem_id)
+                if record is not None and record.content_hash in ('', poem.content_hash):
+                    claimed.add(record.poem_id)
+                else:
+                    is_new = baseline is not None and poem.content_hash not in baseline
+                    unmatched.append((name, poem, is_new or (baseline is None and record is not None)))
+
+        # 第二遍: 插入/删除使序号移动的诗按 content_hash 找回原结果(旧格式结果带哈希时同样)，
+        # 没有哈希的旧格式结果按 标题_作者 找回
+        by_hash = {}
+        by_legacy = {}
+        for record in results:
+            if record.poem_id in claimed:
+                continue
+            if '#' not in record.poem_id:
+                if record.content_hash:
+                    by_hash.setdefault(record.content_hash, []).append(record)
+                else:
+                    by_legacy.setdefault(record.legacy_key(), []).append(record)
+            elif record.content_hash and record.source_file in changed_names:
+                by_hash.setdefault(record.content_hash, []).append(record)
+
+        pending = {}
+        rebound = []
+        for name, poem, queue in unmatched:
+            candidates = by_hash.get(poem.content_hash) or by_legacy.get(poem.legacy_key()) or []
+            record = None
+            while candidates and record is None:
+                candidate = candidates.pop()
+                if candidate.poem_id not in claimed:
+                    record = candidate
+            if record is not None:
+                claimed.add(record.poem_id)
+                rebound.append((record, self._rebind(record, poem)))
+            elif queue:
+                pending.setdefault(name, []).append(poem)  # 新增，或文本已改变
+
+        # 变动文件中没有对应到任何诗词的结果: 文本已改变或已删除；旧格式结果从不作废
+        invalid = [r for r in results
+                   if r.poem_id not in claimed and '#' in r.poem_id and r.source_file in changed_names]
+        if invalid or rebound:
+            self.analyzer.remove_results(invalid + [old for old, _ in rebound])
+            self.analyzer.add_results([new for _, new in rebound])
+
+        # 指纹(含各诗 content_hash 基线)暂存，文件中待分析的诗都有结果后才在 save() 中写入
+        for file_path, name, signature, sha1 in changed:
+            self.staged[name] = ({'signature': signature, 'sha1': sha1, 'hashes': sorted(hashes[name])},
+                                 [p.poem_id for p in pending.get(name, [])])
+
+        pending = [poem for poems in pending.values() for poem in poems]
+        print(f"增量刷新{'(建立基线)' if bootstrap else ''}: {len(changed)} 个文件有变化, 待分析 {len(pending)} 首, "
+              f"作废结果 {len(invalid)} 条, 改挂结果 {len(rebound)} 条")
+        return pending, len(invalid) + len(rebound)
@@ -0,0 +1,140 @@
+"""
+运行前成本与时间规划
+逐文件扫描实际语料，用本地近似分词估算每首诗的提示词 token 数，NumPy 汇总，
+按并发数与观测延迟推算费用和用时；每个文件的 token 统计缓存到磁盘，重新规划时无需再读语料
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+
+from poem_records import shard_of
+from prompt_templates import messages_text
+from scheduler import PRICE_PER_MILLION_TOKENS
+
+
+# DeepSeek 近似换算: 1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+CJK_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.3
+
+OUTPUT_TOKENS_PER_POEM = 60  # {"date":..., "flower":..., "imagery": [...]} 的典型长度
+
+_CJK = re.compile(r'[\u3400-\u9fff\uf900-\ufaff\U00020000-\U0002ffff]')
+
+
+def estimate_tokens(text):
+    """近似 token 数"""
+    cjk = len(_CJK.findall(text))
+    return int(round(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) * OTHER_TOKENS_PER_CHAR))
+
+
+class CostPlanner:
+    """基于实际语料的费用/用时估算"""
+
+    def __init__(self, analyzer, data_loader, cache_path='analysis_output/token_stats.json'):
+        self.analyzer = analyzer
+        self.data_loader = data_loader
+        self.cache_path = cache_path
+        # 提示词模板本身的 token 数(不含诗句)
+        self.prompt_overhead = estimate_tokens(messages_text(analyzer._build_analysis_prompt('')))
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache):
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+
+    def corpus_tokens(self, shard=None):
+        """
+        扫描全部语料文件(有缓存的文件直接复用)
+        Returns:
+            每首诗诗句部分的 token 数数组
+        """
+        cache = self._load_cache()
+        arrays = []
+        rescanned = 0
+
+        for db_name in self.data_loader.databases:
+            db_path = os.path.join(self.data_loader.data_dir, db_name)
+            if not os.path.exists(db_path):
+                continue
+            for file_path in self.data_loader._list_json_files(db_path):
+                name = os.path.basename(file_path)
+                stat = os.stat(file_path)
+                signature = [stat.st_size, int(stat.st_mtime)]
+
+                entry = cache.get(name)
+                if not entry or entry['signature'] != signature:
+                    poems = self.data_loader._load_from_file(file_path, 'full', 1.0, 0)
+                    entry = {'signature': signature,
+                             'index': [p.index for p in poems],
+                             'tokens': [estimate_tokens(p.content) for p in poems]}
+                    cache[name] = entry
+                    rescanned += 1
+
+                tokens = np.asarray(entry['tokens'], dtype=np.int64)
+                if shard:
+                    shard_index, shard_count = shard
+                    keep = np.fromiter((shard_of(f"{name}#{i}", shard_count) == shard_index
+                                        for i in entry['index']), dtype=bool, count=len(entry['index']))
+                    tokens = tokens[keep]
+                arrays.append(tokens)
+
+        if rescanned:
+            self._save_cache(cache)
+        print(f"token 统计: 扫描 {rescanned} 个文件, 其余使用缓存")
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+
+    def plan(self, content_tokens, concurrency=1, latency=4.0, delay=1.0,
+             output_tokens=OUTPUT_TOKENS_PER_POEM):
+        """
+        Args:
+            content_tokens: 每首诗诗句部分的 token 数数组
+            latency (float): 观测到的单次请求平均耗时(秒)
+            delay (float): 每个请求后的间隔(秒)
+        Returns:
+            dict: 数量、token、费用、用时估算
+        """
+        prompt_tokens = np.asarray(content_tokens, dtype=np.int64) + self.prompt_overhead
+        count = len(prompt_tokens)
+        input_total = int(prompt_tokens.sum())
+        output_total = count * output_tokens
+        total_tokens = input_total + output_total
+        seconds = count * (latency + delay) / max(concurrency, 1)
+
+        plan = {
+            'poems': count,
+            'input_tokens': input_total,
+            'output_tokens': output_total,
+            'total_tokens': total_tokens,
+            'prompt_tokens_p50': int(np.percentile(prompt_tokens, 50)) if count else 0,
+            'prompt_tokens_p95': int(np.percentile(prompt_tokens, 95)) if count else 0,
+            'prompt_tokens_max': int(prompt_tokens.max()) if count else 0,
+            'cost': total_tokens * PRICE_PER_MILLION_TOKENS / 1000000,
+            'hours': seconds / 3600
+        }
+
+        print(f"\n规划:")
+        print(f"  诗词数量: {count:,}")
+        print(f"  输入tokens: {input_total:,} (单首 p50 {plan['prompt_tokens_p50']}, "
+              f"p95 {plan['prompt_tokens_p95']}, 最大 {plan['prompt_tokens_max']})")
+        print(f"  输出tokens: {output_total:,}")
+        print(f"  估算费用: {plan['cost']:.2f}")
+        print(f"  估算用时: {plan['hours']:.1f} 小时 (并发 {concurrency}, 延迟 {latency}s, 间隔 {delay}s)")
+        return plan
+
+    def plan_poems(self, poems, **kwargs):
+        """对已加载的诗词列表规划"""
+        return self.plan([estimate_tokens(p.content) for p in poems], **kwargs)
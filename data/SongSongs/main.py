@@ -1,6 +1,17 @@
 #!-*- coding: utf-8 -*-
+"""
+ci.db 与 JSON 分片互转
 
+    python main.py export [--db ci.db] [--shard-size 1000]   # ci.db -> author.song.json + ci.song.*.json
+    python main.py load   [--db ci.db]                       # ci.song.*.json + author.song.json -> ci.db
+"""
+
+import argparse
+import glob
+import io
 import json, sys
+import os
+import re
 import sqlite3
 from collections import OrderedDict
 
@@ -10,37 +21,137 @@ try:               # Python 2
 except NameError:  # Python 3
     pass
 
-c = sqlite3.connect('ci.db')
 
-cursor = c.execute("SELECT name, long_desc, short_desc from ciauthor;")
+SHARD_PATTERN = re.compile(r'ci\.song\.(\d+)\.json$')
+
+
+def _dump_item(item):
+    """与 json.dumps(list, indent=2) 中单个元素的格式一致"""
+    return '  ' + json.dumps(item, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+
+
+def write_json_array(path, items):
+    """逐条写出 JSON 数组，不在内存中拼出整个文件"""
+    count = 0
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(u'[\n')
+        for item in items:
+            if count:
+                f.write(u',\n')
+            f.write(_dump_item(item))
+            count += 1
+        f.write(u'\n]' if count else u']')
+    return count
+
+
+def export_authors(c, path='author.song.json'):
+    cursor = c.execute("SELECT name, long_desc, short_desc from ciauthor;")
+
+    def authors():
+        for row in cursor:
+            author = OrderedDict()
+            author["description"] = row[1]
+            author["name"] = row[0]
+            author["short_description"] = row[2]
+            yield author
+
+    return write_json_array(path, authors())
+
+
+def export_ci(c, out_dir='.', shard_size=1000):
+    """按游标顺序流式写出 ci.song.<起始序号>.json，每片 shard_size 条"""
+    cursor = c.execute("SELECT rhythmic, author, content from ci ORDER BY id;")
+    shard_files = []
+    total = 0
+
+    while True:
+        rows = cursor.fetchmany(shard_size)
+        if not rows:
+            break
+        path = os.path.join(out_dir, 'ci.song.%s.json' % total)
+
+        def cis(rows=rows):
+            for row in rows:
+                ci = OrderedDict()
+                ci["author"] = row[1]
+                ci["paragraphs"] = row[2].split('\n')
+                ci["rhythmic"] = row[0]
+                yield ci
+
+        total += write_json_array(path, cis())
+        shard_files.append(path)
+
+    return shard_files, total
+
+
+def _shard_files(in_dir):
+    """按起始序号排序的 ci.song.*.json"""
+    files = []
+    for path in glob.glob(os.path.join(in_dir, 'ci.song.*.json')):
+        match = SHARD_PATTERN.search(os.path.basename(path))
+        if match:
+            files.append((int(match.group(1)), path))
+    return [path for _, path in sorted(files)]
+
 
-d = {"name": None, "description": None, "short_description": None}
+def _iter_ci_rows(in_dir):
+    for path in _shard_files(in_dir):
+        with io.open(path, 'r', encoding='utf-8') as f:
+            for ci in json.load(f):
+                yield (ci.get("rhythmic"), ci.get("author"), '\n'.join(ci.get("paragraphs", [])))
 
-authors = []
 
-for row in cursor:
-    author = OrderedDict(sorted(d.items(), key=lambda t: t[0]))
-    author["name"] = row[0]
-    author["description"] = row[1]
-    author["short_description"] = row[2]
-    authors.append(author) 
+def _iter_author_rows(path):
+    if not os.path.exists(path):
+        return
+    with io.open(path, 'r', encoding='utf-8') as f:
+        for author in json.load(f):
+            yield (author.get("name"), author.get("description"), author.get("short_description"))
 
-open('author.song.json', 'w').write(json.dumps(authors, indent=2, ensure_ascii=False))
 
+def load_db(c, in_dir='.', author_file='author.song.json'):
+    """将 JSON 分片在一个事务内批量导入，并为 author、rhythmic 建索引"""
+    with c:
+        c.execute("DROP TABLE IF EXISTS ci;")
+        c.execute("DROP TABLE IF EXISTS ciauthor;")
+        c.execute("CREATE TABLE ci (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                  "rhythmic TEXT, author TEXT, content TEXT);")
+        c.execute("CREATE TABLE ciauthor (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                  "name TEXT, long_desc TEXT, short_desc TEXT);")
+        c.executemany("INSERT INTO ci (rhythmic, author, content) VALUES (?, ?, ?);",
+                      _iter_ci_rows(in_dir))
+        c.executemany("INSERT INTO ciauthor (name, long_desc, short_desc) VALUES (?, ?, ?);",
+                      _iter_author_rows(os.path.join(in_dir, author_file)))
+        # 建表数据写完后再建索引
+        c.execute("CREATE INDEX idx_ci_author ON ci (author);")
+        c.execute("CREATE INDEX idx_ci_rhythmic ON ci (rhythmic);")
+        c.execute("CREATE INDEX idx_ciauthor_name ON ciauthor (name);")
 
-cursor = c.execute("SELECT rhythmic, author, content from ci;")
+    ci_count = c.execute("SELECT count(1) FROM ci;").fetchone()[0]
+    author_count = c.execute("SELECT count(1) FROM ciauthor;").fetchone()[0]
+    return ci_count, author_count
 
-d = {"rhythmic": None, "author": None, "paragraphs": None}
 
-cis = []
+def main():
+    parser = argparse.ArgumentParser(description='ci.db <-> ci.song.*.json')
+    parser.add_argument('command', nargs='?', choices=['export', 'load'], default='export')
+    parser.add_argument('--db', default='ci.db')
+    parser.add_argument('--dir', default='.', help='JSON 分片所在目录')
+    parser.add_argument('--shard-size', type=int, default=1000)
+    args = parser.parse_args()
 
-for row in cursor:
-    ci = OrderedDict(sorted(d.items(), key=lambda t: t[0]))
-    ci["rhythmic"] = row[0]
-    ci["author"] = row[1]
-    ci["paragraphs"] = row[2].split('\n')
-    cis.append(ci) 
+    c = sqlite3.connect(args.db)
+    try:
+        if args.command == 'export':
+            export_authors(c, os.path.join(args.dir, 'author.song.json'))
+            shard_files, total = export_ci(c, args.dir, args.shard_size)
+            print('exported %d ci into %d shards' % (total, len(shard_files)))
+        else:
+            ci_count, author_count = load_db(c, args.dir)
+            print('loaded %d ci and %d authors into %s' % (ci_count, author_count, args.db))
+    finally:
+        c.close()
 
-for i in range(0, 21050, 1000):
-    open('ci.song.%s.json' % i, 'w').write(json.dumps(cis[i:i+1000], indent=2, ensure_ascii=False))
 
+if __name__ == '__main__':
+    main()
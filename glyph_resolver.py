@@ -0,0 +1,47 @@
+"""
+表面结构字解析
+将 data/TangPoems/表面结构字.json 编译为一次扫描的替换器，
+把诗句中的 {上休下鳥} 一类部件描述替换为真实字形，无法替换的保留原样并计数
+"""
+
+import json
+import re
+
+
+GLYPH_TABLE_FILE = '表面结构字.json'
+
+# 部件描述形如 {上休下鳥}，最长不超过表中最长的键
+_PLACEHOLDER = re.compile(r'\{[^{}\s]{1,16}\}')
+
+
+class GlyphResolver:
+    """部件描述 -> Unicode 字形"""
+
+    def __init__(self, table_path):
+        with open(table_path, 'r', encoding='utf-8') as f:
+            table = json.load(f)
+
+        # 每个描述取第一个候选字形；空列表表示暂无对应字形
+        self.glyphs = {key: candidates[0]['font']
+                       for key, candidates in table.items() if candidates}
+
+    def resolve(self, text):
+        """
+        替换文本中的部件描述
+        Returns:
+            (替换后文本, 已解析数, 未解析数)
+        """
+        if '{' not in text:
+            return text, 0, 0
+
+        counts = [0, 0]
+
+        def _replace(match):
+            glyph = self.glyphs.get(match.group(0))
+            if glyph is None:
+                counts[1] += 1
+                return match.group(0)
+            counts[0] += 1
+            return glyph
+
+        return _PLACEHOLDER.sub(_replace, text), counts[0], counts[1]
@@ -0,0 +1,191 @@
+"""
+对冲请求
+请求超过观测到的 p95 延迟仍未返回时，再发一个相同请求，先返回者胜出，
+另一个直接关闭其底层连接中止；对冲数量不超过请求总数的一定比例，
+额外消耗计入统计并回调给分析器，计入预算
+"""
+
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scheduler import PRICE_PER_MILLION_TOKENS
+
+
+class AbortableAdapter(HTTPAdapter):
+    """记录本适配器建立的连接，abort() 关闭 socket 以唤醒阻塞中的读取"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = []
+        super().__init__(pool_connections=1, pool_maxsize=1)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+        pool_classes = {}
+        for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+            def _new_conn(pool, base=pool_cls):
+                return adapter._track(base._new_conn(pool))
+            pool_classes[scheme] = type(pool_cls.__name__, (pool_cls,), {'_new_conn': _new_conn})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    def _track(self, conn):
+        with self.lock:
+            # 连接池已丢弃的连接不再保留
+            self.connections = [c for c in self.connections if c.sock is not None]
+            self.connections.append(conn)
+        return conn
+
+    def abort(self):
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            sock = conn.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            conn.close()
+
+
+def _abortable_session():
+    session = requests.Session()
+    adapter = AbortableAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session, adapter
+
+
+class HedgedRequester:
+    """带对冲的 POST"""
+
+    def __init__(self, max_ratio=0.1, percentile=0.95, window=500, min_samples=20, concurrency=1,
+                 on_usage=None):
+        """
+        Args:
+            max_ratio (float): 对冲请求占请求总数的上限
+            percentile (float): 超过该分位延迟即发出对冲
+            window (int): 延迟统计的滑动窗口大小
+            min_samples (int): 样本不足时不对冲
+            concurrency (int): 调用方并发数；每个调用方至多占用主请求、对冲与正在中止的请求各一个线程
+            on_usage (callable): 额外消耗的回调，参数为 usage 字典(PoetryAnalyzer._record_usage)
+        """
+        self.max_ratio = max_ratio
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.on_usage = on_usage
+        self.latencies = deque(maxlen=window)
+        self.executor = ThreadPoolExecutor(max_workers=3 * max(concurrency, 1))
+        self.lock = threading.Lock()
+        self._local = threading.local()  # 每个调用线程复用一个会话(保持长连接)
+        self.stats = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'aborted': 0, 'hedge_tokens': 0}
+
+    def _session(self):
+        if getattr(self._local, 'session', None) is None:
+            self._local.session, self._local.adapter = _abortable_session()
+        return self._local.session, self._local.adapter
+
+    def threshold(self):
+        """当前对冲阈值(秒)，样本不足时为 None"""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[int(self.percentile * (len(ordered) - 1))]
+
+    def _can_hedge(self):
+        with self.lock:
+            return self.stats['hedges'] < self.max_ratio * self.stats['requests']
+
+    def _attempt(self, session, url, kwargs):
+        start = time.perf_counter()
+        response = session.post(url, **kwargs)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _usage(response):
+        try:
+            return response.json().get('usage') or {}
+        except ValueError:
+            return {}
+
+    def post(self, url, **kwargs):
+        """与 requests.post 相同的参数与返回值"""
+        with self.lock:
+            self.stats['requests'] += 1
+        primary_session, primary_adapter = self._session()
+        started = time.perf_counter()
+        primary = self.executor.submit(self._attempt, primary_session, url, kwargs)
+
+        threshold = self.threshold()
+        if threshold is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._can_hedge():
+            return primary.result()
+
+        hedge_session, hedge_adapter = _abortable_session()
+        hedge_started = time.perf_counter()
+        hedge = self.executor.submit(self._attempt, hedge_session, url, kwargs)
+        with self.lock:
+            self.stats['hedges'] += 1
+        adapters = {primary: primary_adapter, hedge: hedge_adapter}
+
+        try:
+            pending = {primary, hedge}
+            winner = None
+            while pending and winner is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # 优先取成功的结果，两个都失败时抛出最后一个异常
+                for future in done:
+                    if future.exception() is None:
+                        winner = future
+                        break
+                if winner is None and not pending:
+                    done.pop().result()
+
+            response = winner.result()
+            loser = hedge if winner is primary else primary
+            if loser.done():
+                extra = self._usage(loser.result()) if loser.exception() is None else {}
+            else:
+                adapters[loser].abort()
+                # 已中止的请求服务端可能仍会计费，按胜出请求的消耗估算
+                extra = {'total_tokens': self._usage(response).get('total_tokens', 0)}
+                with self.lock:
+                    self.stats['aborted'] += 1
+                    # 记录其已等待的时长(延迟下限)，避免慢请求从统计中消失而拉低阈值
+                    self.latencies.append(time.perf_counter() - (started if loser is primary else hedge_started))
+
+            with self.lock:
+                if winner is hedge:
+                    self.stats['hedge_wins'] += 1
+                self.stats['hedge_tokens'] += extra.get('total_tokens', 0)
+            if self.on_usage and extra:
+                self.on_usage(extra)
+            return response
+        finally:
+            hedge_session.close()
+
+    def report(self):
+        with self.lock:
+            stats = dict(self.stats)
+        threshold = self.threshold()
+        ratio = stats['hedges'] / stats['requests'] * 100 if stats['requests'] else 0.0
+        cost = stats['hedge_tokens'] * PRICE_PER_MILLION_TOKENS / 1000000
+        print(f"\n对冲请求统计:")
+        print(f"  请求数: {stats['requests']}, 对冲数: {stats['hedges']} ({ratio:.1f}%, 上限 {self.max_ratio * 100:.1f}%)")
+        print(f"  对冲胜出: {stats['hedge_wins']}, 中止请求: {stats['aborted']}")
+        if threshold is not None:
+            print(f"  当前对冲阈值(p{int(self.percentile * 100)}): {threshold:.2f}s")
+        print(f"  对冲额外tokens: {stats['hedge_tokens']:,} (约 {cost:.4f}, 已计入总消耗)")
+        return stats
@@ -0,0 +1,285 @@
+"""
+本地花卉/意象分类器
+从 analysis_output 中已有的 API 分析结果蒸馏，字符 n-gram 哈希特征 + 线性模型(NumPy)，
+CPU 上对未分析诗词快速打分：置信度高的直接预填，不确定的再交给 API
+"""
+
+import glob
+import json
+import os
+import re
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from poem_records import AnalysisRecord
+
+
+_PUNCTUATION = re.compile(r'[，。、？！；：“”‘’《》（）·\s,.?!;:()\[\]{}\x00]+')
+
+OTHER_FLOWER = '其他'  # 出现次数过少的花卉归为一类
+
+MODEL_PATH = os.path.join('analysis_output', 'imagery_classifier.npz')
+
+FEATURE_VERSION = 2  # 特征哈希方式的版本，变化后旧模型需重新训练
+
+
+def _hash_buckets(keys, dim):
+    """整数键(uint64)的乘法哈希，映射到 [0, dim)"""
+    mixed = keys * np.uint64(0x9E3779B97F4A7C15)
+    return ((mixed >> np.uint64(32)) % np.uint64(dim)).astype(np.int64)
+
+
+def vectorize(texts, dim):
+    """
+    哈希特征，返回 CSR 三元组 (indptr, indices, data)，每行 L2 归一化
+    全部文本去标点后以空字符连接成一个码位数组，一元/二元字符键一次性哈希与计数，不逐首调用 NumPy
+    """
+    n_rows = len(texts)
+    joined = '\x00'.join(_PUNCTUATION.sub('', text) for text in texts)
+    codes = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    separator = codes == 0
+    row_of = np.cumsum(separator)
+    unigram = ~separator
+    bigram = unigram[:-1] & unigram[1:]
+
+    # 码位 < 2^21，二元键 = 高位标记 | 前字 << 21 | 后字
+    keys = np.concatenate([
+        codes[unigram],
+        (codes[:-1][bigram] << np.uint64(21)) | codes[1:][bigram] | np.uint64(1 << 42),
+    ])
+    rows = np.concatenate([row_of[unigram], row_of[:-1][bigram]])
+    cells, counts = np.unique(rows * dim + _hash_buckets(keys, dim), return_counts=True)
+
+    rows = cells // dim
+    values = np.log1p(counts).astype(np.float32)
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_rows)).astype(np.float32)
+    values /= norms[rows]
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cells % dim, values
+
+
+def _csr_dot(csr, weights, max_block=1 << 22):
+    """
+    稀疏矩阵 X 乘以稠密权重 W
+    nnz x K 不超过 max_block 时(如训练)一次算完；打分时逐列计算，避免生成 nnz x K 的中间数组
+    """
+    indptr, indices, data = csr
+    n_rows = len(indptr) - 1
+    out = np.zeros((n_rows, weights.shape[1]), dtype=np.float32)
+    if len(indices) == 0:
+        return out
+    non_empty = np.diff(indptr) > 0
+    starts = indptr[:-1][non_empty]
+    if len(indices) * weights.shape[1] <= max_block:
+        out[non_empty] = np.add.reduceat(weights[indices] * data[:, None], starts, axis=0)
+        return out
+    for col, column in enumerate(np.ascontiguousarray(weights.T)):
+        out[non_empty, col] = np.add.reduceat(column.take(indices) * data, starts)
+    return out
+
+
+def _csr_t_dot(csr, grad, dim):
+    """X 的转置乘以 G，得到权重梯度"""
+    indptr, indices, data = csr
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    out = np.zeros((dim, grad.shape[1]), dtype=np.float32)
+    np.add.at(out, indices, grad[rows] * data[:, None])
+    return out
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _sigmoid(scores):
+    return 1.0 / (1.0 + np.exp(-scores))
+
+
+def load_labeled_results(output_dir='analysis_output', poems_by_id=None):
+    """
+    读取全部分析结果文件作为训练数据
+    Args:
+        poems_by_id (dict): poem_id -> PoemRecord，用于补全新版结果中不含的诗句
+    Returns:
+        list of (content, flower, imagery, author, date)
+    """
+    poems_by_id = poems_by_id or {}
+    labeled = {}
+    for filepath in sorted(glob.glob(os.path.join(output_dir, 'poetry_analysis_*.json'))):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for result in data.get('results', []):
+            if result.get('method', 'llm') != 'llm':
+                continue  # 不用分类器自己的预填结果训练
+            content = result.get('content')
+            poem_id = result.get('poem_id')
+            if content is None and poem_id in poems_by_id:
+                content = poems_by_id[poem_id].content
+            if not content:
+                continue
+            analysis = result.get('analysis', {})
+            key = poem_id or f"{result.get('title')}_{result.get('author')}"
+            labeled[key] = (content, analysis.get('flower', '无'), analysis.get('imagery', []),
+                            result.get('author', '未知'), analysis.get('date', 0))
+    return list(labeled.values())
+
+
+class ImageryClassifier:
+    """花卉(多分类) + 意象标签(多标签) 线性分类器"""
+
+    def __init__(self, dim=2 ** 16, min_flower_count=3, max_tags=50):
+        self.dim = dim
+        self.min_flower_count = min_flower_count
+        self.max_tags = max_tags
+        self.flowers = []
+        self.tags = []
+        self.author_years = {}
+        self.flower_weights = None
+        self.tag_weights = None
+
+    def fit(self, labeled, epochs=200, learning_rate=2.0, l2=1e-4):
+        """全量梯度下降训练"""
+        texts = [row[0] for row in labeled]
+
+        flower_counts = Counter(row[1] for row in labeled)
+        self.flowers = sorted(f for f, c in flower_counts.items() if c >= self.min_flower_count)
+        self.flowers.append(OTHER_FLOWER)
+        flower_index = {f: i for i, f in enumerate(self.flowers)}
+        y_flower = np.zeros((len(labeled), len(self.flowers)), dtype=np.float32)
+        for i, row in enumerate(labeled):
+            y_flower[i, flower_index.get(row[1], flower_index[OTHER_FLOWER])] = 1.0
+
+        tag_counts = Counter(tag for row in labeled for tag in set(row[2]))
+        self.tags = [tag for tag, _ in tag_counts.most_common(self.max_tags)]
+        tag_index = {t: i for i, t in enumerate(self.tags)}
+        y_tags = np.zeros((len(labeled), len(self.tags)), dtype=np.float32)
+        for i, row in enumerate(labeled):
+            for tag in row[2]:
+                if tag in tag_index:
+                    y_tags[i, tag_index[tag]] = 1.0
+
+        # 预填年代: 同一作者已知年代的中位数
+        years = defaultdict(list)
+        for row in labeled:
+            if row[4]:
+                years[row[3]].append(int(row[4]))
+        self.author_years = {author: int(np.median(v)) for author, v in years.items()}
+
+        csr = vectorize(texts, self.dim)
+        n = float(len(labeled))
+        self.flower_weights = np.zeros((self.dim, len(self.flowers)), dtype=np.float32)
+        self.tag_weights = np.zeros((self.dim, len(self.tags)), dtype=np.float32)
+
+        for _ in range(epochs):
+            grad = (_softmax(_csr_dot(csr, self.flower_weights)) - y_flower) / n
+            self.flower_weights -= learning_rate * (_csr_t_dot(csr, grad, self.dim) + l2 * self.flower_weights)
+            if self.tags:
+                grad = (_sigmoid(_csr_dot(csr, self.tag_weights)) - y_tags) / n
+                self.tag_weights -= learning_rate * (_csr_t_dot(csr, grad, self.dim) + l2 * self.tag_weights)
+
+        accuracy = (_softmax(_csr_dot(csr, self.flower_weights)).argmax(axis=1) == y_flower.argmax(axis=1)).mean()
+        print(f"分类器训练完成: {len(labeled)} 条样本, {len(self.flowers)} 类花卉, "
+              f"{len(self.tags)} 个意象标签, 训练集准确率 {accuracy:.1%}")
+        return self
+
+    def predict(self, texts, block_size=20000, with_tags=True):
+        """
+        分块打分
+        Args:
+            with_tags (bool): 为 False 时不计算意象概率(返回 0 列矩阵)
+        Returns:
+            (花卉下标, 花卉置信度, 意象概率矩阵)
+        """
+        flower_ids = []
+        confidences = []
+        tag_probs = []
+        for start in range(0, len(texts), block_size):
+            csr = vectorize(texts[start:start + block_size], self.dim)
+            probs = _softmax(_csr_dot(csr, self.flower_weights))
+            flower_ids.append(probs.argmax(axis=1))
+            confidences.append(probs.max(axis=1))
+            if self.tags and with_tags:
+                tag_probs.append(_sigmoid(_csr_dot(csr, self.tag_weights)))
+            else:
+                tag_probs.append(np.zeros((len(probs), 0), dtype=np.float32))
+        if not flower_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, len(self.tags) if with_tags else 0))
+        return np.concatenate(flower_ids), np.concatenate(confidences), np.vstack(tag_probs)
+
+    def triage(self, poems, threshold=0.9, tag_threshold=0.5):
+        """
+        分流待分析诗词
+        Returns:
+            (预填结果 AnalysisRecord 列表, 需调用 API 的诗词列表)
+            API 列表中有花卉可能的诗词在前，其余按置信度从低到高
+        """
+        flower_ids, confidences, _ = self.predict([p.content for p in poems], with_tags=False)
+        # 意象标签只对预填的诗词计算
+        other = self.flowers.index(OTHER_FLOWER)
+        confident = np.flatnonzero((confidences >= threshold) & (flower_ids != other)).tolist()
+        tag_probs = dict(zip(confident, self.predict([poems[i].content for i in confident])[2]))
+
+        prefilled = []
+        uncertain = []
+        for row, (poem, flower_id, confidence) in enumerate(zip(poems, flower_ids, confidences)):
+            flower = self.flowers[flower_id]
+            if row in tag_probs:
+                probs = tag_probs[row]
+                imagery = [self.tags[i] for i in np.argsort(-probs) if probs[i] >= tag_threshold]
+                analysis = {'date': self.author_years.get(poem.author, 0),
+                            'flower': flower, 'imagery': imagery}
+                prefilled.append(AnalysisRecord.from_poem(poem, analysis, time.time(), method='classifier'))
+            else:
+                high_value = flower not in ('无', OTHER_FLOWER)
+                uncertain.append((not high_value, confidence, poem))
+
+        uncertain.sort(key=lambda item: (item[0], item[1]))
+        to_api = [poem for _, _, poem in uncertain]
+        print(f"本地分类器分流: 预填 {len(prefilled)} 首, 交给API {len(to_api)} 首")
+        return prefilled, to_api
+
+    def save(self, path):
+        np.savez_compressed(
+            path, flower_weights=self.flower_weights, tag_weights=self.tag_weights,
+            meta=np.array(json.dumps({
+                'features': FEATURE_VERSION, 'dim': self.dim, 'flowers': self.flowers, 'tags': self.tags,
+                'author_years': self.author_years
+            }, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        meta = json.loads(str(data['meta']))
+        if meta.get('features', 1) != FEATURE_VERSION:
+            raise ValueError(f"模型特征版本已过期，请先运行 python imagery_classifier.py 重新训练: {path}")
+        model = cls(dim=meta['dim'])
+        model.flowers = meta['flowers']
+        model.tags = meta['tags']
+        model.author_years = meta['author_years']
+        model.flower_weights = data['flower_weights']
+        model.tag_weights = data['tag_weights']
+        return model
+
+
+def main():
+    """用已有分析结果训练分类器并保存"""
+    from json_poem_analyzer import DataLoader
+
+    poems = DataLoader('data').load_poems(mode='full')
+    labeled = load_labeled_results('analysis_output', {p.poem_id: p for p in poems})
+    if not labeled:
+        print("没有可用的训练数据")
+        return
+
+    model = ImageryClassifier().fit(labeled)
+    model.save(MODEL_PATH)
+    print(f"分类器已保存到: {MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,205 @@
 #main
+import argparse
 import json
+import random
 import requests
+import sys
 import time
 import os
 import glob
-from collections import defaultdict
+import re
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from poem_records import PoemRecord, AnalysisRecord, shard_of
+from result_export import ColumnarExporter, append_journal, latest_results_file
+from glyph_resolver import GlyphResolver, GLYPH_TABLE_FILE
+from poem_dedup import ContentDeduper
+from batch_jobs import BatchJobWriter, BatchIngester, write_fake_responses
+from scheduler import (BudgetScheduler, PRICE_PER_MILLION_TOKENS, PRICE_PER_MILLION_CACHE_HIT_TOKENS,
+                       load_queue)
+from response_parser import parse_response, PARSE_INVALID
+from stage_timer import STAGE_TIMER, timed, profiled
+from prompt_templates import TEMPLATES, DEFAULT_VERSION, build_messages
+
+
+API_URL = os.environ.get('DEEPSEEK_API_URL', "https://api.deepseek.com/v1/chat/completions")
+
+QUEUE_FILE = 'pending_queue.json'  # 调度器停止时的剩余队列
+
+FAILED_RESPONSES_FILE = 'failed_responses.jsonl'  # 解析失败的原始响应
 
 
 class PoetryAnalyzer:
 
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, api_url=API_URL, hedger=None, prompt_version=DEFAULT_VERSION):
         self.api_key = api_key
+        self.api_url = api_url
+        self.hedger = hedger  # HedgedRequester，为 None 时不对冲
+        if hedger:
+            hedger.on_usage = self._record_usage  # 对冲与被中止请求的消耗计入总消耗(预算)
+        self.prompt_version = prompt_version  # prompt_templates 中的模板版本
         self.total_tokens = 0
+        self.cache_hit_tokens = 0  # 本次运行命中前缀缓存的输入 tokens
+        self.cache_miss_tokens = 0
         self.analysis_results = []
         self.processed_count = 0
+        self.exported_count = 0  # 已增量导出的结果数
+        self.journaled_count = 0  # 已写入结果日志的结果数
+        self.journal_reset = True  # 未加载旧结果时，首次写日志前作废此前的结果
+        self.removed_ids = []  # 待写入结果日志的作废 poem_id
+        self.export_reset = True  # 未加载旧结果时，首次导出前开始新一代列式导出
+        self.export_removed_ids = []  # 待写入列式导出的作废 poem_id
+        self.lock = threading.Lock()  # 并发分析时保护结果与计数
+        self.parse_stats = Counter()  # 响应解析类别统计
+        self.failed_responses = []  # 解析失败的原始响应，保存时写入 FAILED_RESPONSES_FILE
 
     def analyze_poem(self, poem_data):
         """分析单首"""
-        prompt = self._build_analysis_prompt(poem_data['content'])
+        messages = self._build_analysis_prompt(poem_data.content)
 
         try:
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                json={
-                    "model": "deepseek-chat",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.1
-                },
-                timeout=30
-            )
+            post = self.hedger.post if self.hedger else requests.post
+            with STAGE_TIMER.stage('request'):
+                response = post(
+                    self.api_url,
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    json=self._build_request_body(messages),
+                    timeout=30
+                )
 
             if response.status_code == 200:
                 result = response.json()
-                content = result['choices'][0]['message']['content']
-                cleaned_content = self._clean_response(content)
-                parsed_result = self._parse_json_result(cleaned_content)
+                self._record_usage(result.get('usage'))
+                analysis_record = self._record_from_completion(poem_data, result)
 
-                if parsed_result:
-                    standardized = self._standardize_result(parsed_result)
-
-
-                    analysis_record = {
-                        'title': poem_data['title'],
-                        'author': poem_data['author'],
-                        'content': poem_data['content'],  #Retain the complete poetic content
-                        'analysis': standardized,
-                        'source_file': poem_data['source_file'],
-                        'analysis_timestamp': time.time()
-                    }
-
-                    self.analysis_results.append(analysis_record)
-                    self.processed_count += 1
-                    return True
+                if analysis_record:
+                    with self.lock:
+                        self.analysis_results.append(analysis_record)
+                        self.processed_count += 1
+                    return analysis_record
 
         except Exception as e:
             print(f"分析失败: {e}")
 
-        return False
-
-    def _build_analysis_prompt(self, content):
-        return f"""请分析以下诗歌并输出JSON格式结果：
+        return None
 
-{content}
+    def _build_request_body(self, messages):
+        """chat/completions 请求体(在线调用与批量任务共用)"""
+        return {
+            "model": "deepseek-chat",
+            "messages": messages,
+            "temperature": 0.1
+        }
 
-要求：
-1. 分析创作年代（公元纪年，公元前用负值）
-2. 识别相关花卉
-3. 提取核心意象标签
+    def _record_from_completion(self, poem_data, completion):
+        """从 chat/completions 响应构建分析结果，解析失败返回 None"""
+        content = completion['choices'][0]['message']['content']
+        with STAGE_TIMER.stage('parse'):
+            cleaned_content = self._clean_response(content)
+            parsed_result, category = parse_response(cleaned_content)
+        if parsed_result:
+            try:
+                standardized = self._standardize_result(parsed_result)
+            except (TypeError, ValueError, AttributeError):
+                parsed_result, category = None, PARSE_INVALID  # 字段无法标准化，同样保留原始响应
+
+        with self.lock:
+            self.parse_stats[category] += 1
+            if parsed_result is None:
+                # 保留原始响应，便于离线重新解析
+                self.failed_responses.append({'poem': poem_data, 'category': category, 'raw': content})
+        if not parsed_result:
+            return None
 
-输出格式：
-{{"date": 年代, "flower": "花卉", "imagery": ["意象1", "意象2"]}}"""
+        # 结果只通过 poem_id 引用原诗，不再复制全文
+        return AnalysisRecord.from_poem(poem_data, standardized, time.time())
+
+    def _record_usage(self, usage):
+        """累计响应中实际消耗的 tokens"""
+        if usage:
+            with self.lock:
+                self.total_tokens += usage.get('total_tokens', 0)
+                self.cache_hit_tokens += usage.get('prompt_cache_hit_tokens', 0)
+                self.cache_miss_tokens += usage.get('prompt_cache_miss_tokens', 0)
+
+    def report_prompt_cache(self):
+        """前缀缓存命中情况及节省的输入费用"""
+        cached = self.cache_hit_tokens + self.cache_miss_tokens
+        if not cached:
+            return
+        saved = self.cache_hit_tokens * (PRICE_PER_MILLION_TOKENS - PRICE_PER_MILLION_CACHE_HIT_TOKENS) / 1000000
+        print(f"提示词缓存({self.prompt_version}): 命中 {self.cache_hit_tokens:,} / 未命中 {self.cache_miss_tokens:,} tokens "
+              f"(命中率 {self.cache_hit_tokens / cached * 100:.1f}%, 节省约 {saved:.4f})")
+
+    def add_results(self, records):
+        """加入不经 API 得到的结果(去重复用、分类器预填)"""
+        with self.lock:
+            self.analysis_results.extend(records)
+
+    def remove_results(self, records):
+        """作废结果(按对象，旧格式结果可能同键)，保持增量导出与结果日志的计数一致"""
+        removed = {id(r) for r in records}
+        with self.lock:
+            results = self.analysis_results
+            self.exported_count -= sum(1 for r in results[:self.exported_count] if id(r) in removed)
+            self.journaled_count -= sum(1 for r in results[:self.journaled_count] if id(r) in removed)
+            self.analysis_results = [r for r in results if id(r) not in removed]
+            remaining = {r.poem_id for r in self.analysis_results}
+            removed_ids = {r.poem_id for r in records} - remaining
+            self.removed_ids.extend(removed_ids)
+            self.export_removed_ids.extend(removed_ids)
+
+    @timed('prompt')
+    def _build_analysis_prompt(self, content):
+        """按模板版本构建 messages，诗句在最后"""
+        return build_messages(content, self.prompt_version)
 
     def _clean_response(self, content):
         content = content.replace('```json', '').replace('```', '').strip()
         return content
 
     def _parse_json_result(self, content):
-        try:
-            return json.loads(content)
-        except:
-            return None
+        return parse_response(content)[0]
 
+    @timed('standardize')
     def _standardize_result(self, result):
         """标准化分析结果"""
+        flowers = self._as_tags(result.get('flower'))
         return {
             "date": self._standardize_date(result.get('date', 0)),
-            "flower": self._standardize_flower(result.get('flower', '无')),
-            "imagery": result.get('imagery', [])
+            "flower": self._standardize_flower(flowers[0] if flowers else '无'),  # 多个花卉取第一个
+            "imagery": self._as_tags(result.get('imagery'))
         }
 
+    def _as_tags(self, value):
+        """字符串(按分隔符拆分)、数字或嵌套列表/对象统一展开为字符串列表"""
+        if value is None or value == '':
+            return []
+        if isinstance(value, str):
+            return [tag for tag in re.split(r'[、，,；;\s]+', value) if tag]
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, (list, tuple)):
+            return [tag for item in value for tag in self._as_tags(item)]
+        return [str(value)]
+
     def _standardize_date(self, date_val):
-        """标准化日期"""
+        """标准化日期，兼容 公元1070年、约1070年、公元前221年 等写法"""
         try:
             if isinstance(date_val, (int, float)):
                 return int(date_val)
             date_str = str(date_val)
-            if '公元前' in date_str:
-                return -int(date_str.replace('公元前', ''))
-            return int(date_str) if date_str.isdigit() else 0
-        except:
+            match = re.search(r'-?\d+', date_str)
+            if not match:
+                return 0
+            year = int(match.group(0))
+            if '公元前' in date_str or date_str.lstrip().startswith('前'):
+                return -abs(year)
+            return year
+        except (ValueError, TypeError):
             return 0
 
     def _standardize_flower(self, flower):
@@ -112,6 +211,7 @@ class PoetryAnalyzer:
         }
         return mapping.get(flower, flower)
 
+    @timed('checkpoint')
     def save_results(self, output_dir='analysis_output'):
         """统一目录"""
         # 创建输出目录
@@ -124,6 +224,8 @@ class PoetryAnalyzer:
         filepath = os.path.join(output_dir, filename)
 
         # 构建完整输出数据
+        with self.lock:
+            results = [record.to_dict() for record in self.analysis_results]
         output_data = {
             'project': '唐宋词花卉意象分析',
             'analysis_date': time.strftime('%Y-%m-%d %H:%M:%S'),
@@ -132,17 +234,98 @@ class PoetryAnalyzer:
             'metadata': {
                 'output_dir': output_dir,
                 'file_created': timestamp,
-                'api_tokens_used': self.total_tokens
+                'api_tokens_used': self.total_tokens,
+                'prompt_version': self.prompt_version,
+                'prompt_cache_hit_tokens': self.cache_hit_tokens,
+                'prompt_cache_miss_tokens': self.cache_miss_tokens,
+                'parse_stats': dict(self.parse_stats)
             },
-            'results': self.analysis_results
+            'results': results
         }
 
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(output_data, f, ensure_ascii=False, indent=2)
+        self._append_journal(output_dir)
+        self._save_failed_responses(output_dir)
 
         print(f"分析结果已保存到: {filepath}")
         return filepath
 
+    def _append_journal(self, output_dir):
+        """在完整结果文件之后追加日志，查询服务据此增量更新"""
+        with self.lock:
+            new_records = self.analysis_results[self.journaled_count:]
+            removed, self.removed_ids = self.removed_ids, []
+            reset, self.journal_reset = self.journal_reset, False
+            self.journaled_count += len(new_records)
+        append_journal(output_dir, new_records, removed, reset)
+
+    def _save_failed_responses(self, output_dir):
+        """追加写出解析失败的原始响应"""
+        with self.lock:
+            failed, self.failed_responses = self.failed_responses, []
+        if not failed:
+            return
+        with open(os.path.join(output_dir, FAILED_RESPONSES_FILE), 'a', encoding='utf-8') as f:
+            for item in failed:
+                poem = item['poem']
+                f.write(json.dumps({
+                    'poem_id': poem.poem_id, 'title': poem.title, 'author': poem.author,
+                    'source_file': poem.source_file, 'index': poem.index, 'rhythmic': poem.rhythmic,
+                    'content_hash': poem.content_hash, 'category': item['category'], 'raw': item['raw']
+                }, ensure_ascii=False) + '\n')
+
+    def reparse_failed(self, output_dir='analysis_output'):
+        """用当前解析器重新解析保存的失败响应，成功的加入结果，其余保留；之后已有结果的直接丢弃"""
+        path = os.path.join(output_dir, FAILED_RESPONSES_FILE)
+        if not os.path.exists(path):
+            return 0
+
+        analyzed = {r.poem_id for r in self.analysis_results}
+        recovered = 0
+        superseded = 0
+        remaining = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                poem = PoemRecord(item['title'], item['author'], '', item['source_file'],
+                                  item['index'], item.get('rhythmic'), item.get('content_hash'))
+                if poem.poem_id in analyzed:
+                    superseded += 1  # 重试已成功
+                    continue
+                parsed_result, category = parse_response(self._clean_response(item['raw']))
+                if parsed_result:
+                    record = AnalysisRecord.from_poem(poem, self._standardize_result(parsed_result), time.time())
+                    self.add_results([record])
+                    analyzed.add(poem.poem_id)
+                    recovered += 1
+                else:
+                    item['category'] = category
+                    remaining.append(item)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            for item in remaining:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        print(f"重新解析失败响应: 恢复 {recovered} 条, 仍失败 {len(remaining)} 条, 已有结果丢弃 {superseded} 条")
+        return recovered
+
+    @timed('export')
+    def export_columnar(self, exporter):
+        """将上次导出之后的作废与新结果写入列式导出"""
+        with self.lock:
+            reset, self.export_reset = self.export_reset, False
+            if reset or exporter.is_empty():
+                self.exported_count = 0  # 新一代或尚无导出: 导出全部结果
+            new_records = self.analysis_results[self.exported_count:]
+            removed, self.export_removed_ids = self.export_removed_ids, []
+        if reset:
+            exporter.reset()
+        exporter.remove(removed)
+        exporter.append(new_records)
+        exporter.flush()
+        self.exported_count += len(new_records)
+        return len(new_records)
+
     def load_previous_results(self, output_dir='analysis_output'):
         #加载之前的分析结果
         if not os.path.exists(output_dir):
@@ -150,29 +333,30 @@ class PoetryAnalyzer:
 
         try:
             #找到最新的分析文件
-            json_files = glob.glob(os.path.join(output_dir, 'poetry_analysis_*.json'))
-            if not json_files:
+            latest_file = latest_results_file(output_dir)
+            if not latest_file:
                 return set(), 0
 
-            latest_file = max(json_files, key=os.path.getctime)
             print(f"加载最新分析文件: {os.path.basename(latest_file)}")
 
             with open(latest_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
-            # 构建已分析诗词的索引
-            analyzed_poems = set()
-            for result in data.get('results', []):
-                key = f"{result['title']}_{result['author']}"
-                analyzed_poems.add(key)
+            # 恢复结果并构建已分析诗词的索引(poem_id 与旧版 标题_作者 键)
+            # 旧版结果带有诗句哈希时ID为 标题_作者@哈希，同键的其他诗(如同一作者的无题词)不算已分析
+            self.analysis_results = [AnalysisRecord.from_dict(r) for r in data.get('results', [])]
+            analyzed_poems = {record.poem_id for record in self.analysis_results}
 
-            # 恢复计数和结果
+            # 恢复计数(已恢复的结果视为上次运行已导出)
             self.processed_count = data.get('total_processed', 0)
-            self.analysis_results = data.get('results', [])
+            self.exported_count = len(self.analysis_results)
+            self.journaled_count = len(self.analysis_results)
+            self.journal_reset = False
+            self.export_reset = False
             self.total_tokens = data.get('metadata', {}).get('api_tokens_used', 0)
 
-            print(f"已加载之前分析结果: {len(analyzed_poems)} 首诗词")
-            return analyzed_poems, len(analyzed_poems)
+            print(f"已加载之前分析结果: {len(self.analysis_results)} 首诗词")
+            return analyzed_poems, len(self.analysis_results)
 
         except Exception as e:
             print(f"加载之前结果失败: {e}")
@@ -184,33 +368,40 @@ class DataLoader:
         self.data_dir = data_dir
         self.databases = ['SongSongs', 'TangPoems', 'TangPoems2']
 
+        # 表面结构字表不是诗词数据，编译为字形替换器
+        self.glyph_resolver = None
+        self.glyph_stats = defaultdict(lambda: {'resolved': 0, 'unresolved': 0})
+        table_path = os.path.join(data_dir, 'TangPoems', GLYPH_TABLE_FILE)
+        if os.path.exists(table_path):
+            self.glyph_resolver = GlyphResolver(table_path)
+
+    def _list_json_files(self, db_path):
+        """列出数据库目录下的诗词文件(排除表面结构字表)"""
+        json_files = sorted(glob.glob(os.path.join(db_path, '*.json')))  # 排序保证各机器顺序一致
+        return [f for f in json_files if os.path.basename(f) != GLYPH_TABLE_FILE]
+
     def scan_databases(self):
         """扫描数据库统计信息"""
 
         print("扫描数据库文件...")
         stats = {}
         total_files = 0
-        total_poems_estimate = 0
 
         for db_name in self.databases:
             db_path = os.path.join(self.data_dir, db_name)
             if os.path.exists(db_path):
-                json_files = glob.glob(os.path.join(db_path, '*.json'))
+                json_files = self._list_json_files(db_path)
                 file_count = len(json_files)
                 stats[db_name] = file_count
                 total_files += file_count
 
-                # 估算诗词数量（基于文件数量）
-                poems_estimate = file_count * 1000  # 假设每个文件约1000首
-                total_poems_estimate += poems_estimate
-                print(f"  {db_name}: {file_count} 个文件 (约{poems_estimate}首)")
+                print(f"  {db_name}: {file_count} 个文件")
             else:
                 stats[db_name] = 0
                 print(f"  {db_name}: 目录不存在")
 
         print(f"文件总数: {total_files}")
-        print(f"估算诗词总数: {total_poems_estimate}")
-        return stats, total_poems_estimate
+        return stats, total_files
 
     def load_poems(self, mode='sample', sample_size=100, sample_rate=0.01, limit=None):
         """load"""
@@ -222,7 +413,7 @@ class DataLoader:
             if not os.path.exists(db_path):
                 continue
 
-            json_files = glob.glob(os.path.join(db_path, '*.json'))
+            json_files = self._list_json_files(db_path)
             print(f"处理 {db_name} 数据库 ({len(json_files)} 个文件)...")
 
             files_to_process = json_files
@@ -241,8 +432,23 @@ class DataLoader:
                 break
 
         print(f"成功加载 {len(all_poems)} 首诗词")
+        self._report_glyph_stats()
         return all_poems
 
+    def _report_glyph_stats(self):
+        """输出各文件部件描述的替换统计"""
+        if not self.glyph_stats:
+            return
+        resolved = sum(s['resolved'] for s in self.glyph_stats.values())
+        unresolved = sum(s['unresolved'] for s in self.glyph_stats.values())
+        print(f"表面结构字: 已替换 {resolved} 处, 未解析 {unresolved} 处")
+        # 只显示未解析最多的10个文件，完整统计见 glyph_stats
+        worst = sorted(self.glyph_stats.items(), key=lambda kv: kv[1]['unresolved'], reverse=True)
+        for source_file, stats in worst[:10]:
+            if stats['unresolved']:
+                print(f"  {source_file}: 未解析 {stats['unresolved']} 处")
+
+    @timed('load')
     def _load_from_file(self, file_path, mode, sample_rate, sample_size):
         """从单个文件加载数据"""
         try:
@@ -251,17 +457,18 @@ class DataLoader:
 
             poems = []
             if isinstance(data, list):
-                items_to_process = data
+                # 保留文件内序号，用于生成稳定的 poem_id
+                items_to_process = list(enumerate(data))
 
                 # 应用采样策略
                 if mode == 'sample' and len(data) > sample_size:
-                    import random
-                    items_to_process = random.sample(data, sample_size)
+                    items_to_process = random.sample(items_to_process, sample_size)
                 elif mode == 'rate' and sample_rate < 1.0:
-                    items_to_process = [item for i, item in enumerate(data) if i % int(1/sample_rate) == 0]
+                    items_to_process = [(i, item) for i, item in items_to_process if i % int(1/sample_rate) == 0]
 
-                for item in items_to_process:
-                    poem = self._extract_poem_data(item, file_path)
+                source_file = os.path.basename(file_path)
+                for index, item in items_to_process:
+                    poem = self._extract_poem_data(item, source_file, index)
                     if poem:
                         poems.append(poem)
 
@@ -271,23 +478,28 @@ class DataLoader:
             print(f"文件读取失败 {file_path}: {e}")
             return []
 
-    def _extract_poem_data(self, item, source_file):
+    def _extract_poem_data(self, item, source_file, index):
         """提取诗词数据"""
         if not isinstance(item, dict):
             return None
 
-        # 提取标题、作者、内容
-        title = item.get('title') or '无题'
+        # 提取标题、作者、内容；宋词无标题时以词牌为题(旧版键仍为 无题_作者)
+        rhythmic = item.get('rhythmic')
+        title = item.get('title') or rhythmic or '无题'
+        legacy_title = None if item.get('title') or not rhythmic else '无题'
         author = item.get('author') or '未知'
         content = item.get('content') or ' '.join(item.get('paragraphs', []))
 
+        if content and self.glyph_resolver:
+            content, resolved, unresolved = self.glyph_resolver.resolve(content)
+            if resolved or unresolved:
+                stats = self.glyph_stats[source_file]
+                stats['resolved'] += resolved
+                stats['unresolved'] += unresolved
+
         if content and len(content.strip()) > 10:
-            return {
-                'title': str(title),
-                'author': str(author),
-                'content': str(content),  #  complete poetic content
-                'source_file': os.path.basename(source_file)
-            }
+            return PoemRecord(str(title), author, str(content), source_file, index, rhythmic,
+                              legacy_title=legacy_title)
 
         return None
 
@@ -296,7 +508,7 @@ def calculate_cost_estimate(total_poems):
     """计算成本估算"""
     tokens_per_poem = 800
     total_tokens = total_poems * tokens_per_poem
-    cost = total_tokens * 0.14 / 1000000
+    cost = total_tokens * PRICE_PER_MILLION_TOKENS / 1000000
 
     print(f"\n估算:")
     print(f"  诗词数量: {total_poems}")
@@ -306,18 +518,447 @@ def calculate_cost_estimate(total_poems):
     return cost
 
 
+def estimate_cost(analyzer, poems, **kwargs):
+    """按实际诗句长度规划费用与用时(CostPlanner)；无 numpy 时退回粗略估算"""
+    try:
+        from cost_planner import CostPlanner
+    except ImportError:
+        return calculate_cost_estimate(len(poems))
+    return CostPlanner(analyzer, None).plan_poems(poems, **kwargs)
+
+
+def parse_shard(value):
+    """解析 --shard i/N (i 从0开始)"""
+    try:
+        index, count = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"分片编号超出范围: {value}")
+    return index, count
+
+
+def filter_analyzed(poems, analyzed_poems):
+    """过滤掉已分析的诗词；旧版键带哈希时，只对同键的诗计算诗句哈希"""
+    hashed_keys = {key.rsplit('@', 1)[0] for key in analyzed_poems if '@' in key}
+
+    def analyzed(poem):
+        if poem.poem_id in analyzed_poems:
+            return True
+        key = poem.legacy_key()
+        return key in analyzed_poems or (key in hashed_keys and f"{key}@{poem.content_hash}" in analyzed_poems)
+
+    return [p for p in poems if not analyzed(p)]
+
+
+def run_analysis(analyzer, poems, output_dir='analysis_output', concurrency=1,
+                 delay=1.0, checkpoint_every=20, exporter=None, dedup=True, scheduler=None):
+    """
+    分析诗词列表，定期保存检查点
+    dedup 为 True 时同文诗词只分析一次，结果复制给其他来源
+    给定 scheduler 时按其优先级派发，达到预算/截止时间即停止，剩余队列写入输出目录
+    Returns:
+        (成功数, 最终结果文件)
+    """
+    deduper = None
+    if dedup:
+        deduper = ContentDeduper()
+        poems, reused = deduper.dedup(poems, analyzer.analysis_results)
+        analyzer.add_results(reused)
+
+    if scheduler:
+        scheduler.push(poems)
+        pending = scheduler
+    else:
+        pending = iter(poems)
+
+    print(f"\n开始诗词分析...")
+    print(f"目标分析数量: {len(poems)} 首 (并发 {concurrency})")
+
+    success_count = 0
+    start_time = time.time()
+
+    def _analyze(poem):
+        ok = analyzer.analyze_poem(poem)
+        # 请求间隔
+        time.sleep(delay)
+        return ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        i = 0
+        while True:
+            # 保持 concurrency 个请求在途
+            while len(futures) < concurrency:
+                poem = next(pending, None)
+                if poem is None:
+                    break
+                futures[executor.submit(_analyze, poem)] = poem
+            if not futures:
+                break
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i += 1
+                poem = futures.pop(future)
+                record = future.result()
+                if scheduler:
+                    scheduler.done(poem, bool(record))
+                if record:
+                    success_count += 1
+                    if deduper:
+                        analyzer.add_results(deduper.fan_out(record))
+                    print(f"进度: {i}/{len(poems)} 《{poem.title}》 - {poem.author} 分析成功")
+                else:
+                    if deduper:
+                        # 代表失败时同文诗词也未分析，随代表进入剩余队列
+                        released = deduper.release(poem.poem_id)
+                        if scheduler:
+                            scheduler.defer(released)
+                    print(f"进度: {i}/{len(poems)} 《{poem.title}》 - {poem.author} 分析失败")
+
+                # 每分析 checkpoint_every 首保存一次
+                #速度估算器
+                if i % checkpoint_every == 0:
+                    analyzer.save_results(output_dir)
+                    if exporter:
+                        analyzer.export_columnar(exporter)
+                    elapsed_time = time.time() - start_time
+                    poems_per_minute = i / (elapsed_time / 60)
+                    print(f"已保存检查点 | 速度: {poems_per_minute:.1f} 首/分钟")
+
+    if scheduler:
+        if deduper:
+            scheduler.defer(deduper.remaining())
+        scheduler.report()
+        queue_path = os.path.join(output_dir, QUEUE_FILE)
+        remaining = scheduler.save_queue(queue_path)
+        print(f"剩余队列 {remaining} 首已保存到: {queue_path}")
+
+    reused_count = deduper.report() if deduper else 0
+
+    if success_count == 0 and reused_count == 0:
+        print("none")
+        STAGE_TIMER.report()
+        return 0, None
+
+    # 最终保存
+    final_file = analyzer.save_results(output_dir)
+    if exporter:
+        analyzer.export_columnar(exporter)
+
+    # 分析统计
+    elapsed_time = time.time() - start_time
+
+    print(f"\n分析完成统计:")
+    print(f"总处理诗词: {analyzer.processed_count}")
+    print(f"成功分析: {success_count}")
+    if poems:
+        print(f"成功率: {(success_count/len(poems))*100:.1f}%")
+    print(f"总用时: {elapsed_time/60:.1f} 分钟")
+    print(f"响应解析: {dict(analyzer.parse_stats)}")
+    analyzer.report_prompt_cache()
+    print(f"结果文件: {final_file}")
+    if analyzer.hedger:
+        analyzer.hedger.report()
+    STAGE_TIMER.report()
+    return success_count, final_file
+
+
+def merge_results(input_dirs, output_dir):
+    """合并各分片的最新结果，同一 poem_id 保留较新的分析(旧版结果ID见 poem_records.legacy_id)"""
+    merged = {}
+    analyzer = PoetryAnalyzer(None)
+    total_tokens = 0
+    for input_dir in input_dirs:
+        shard = PoetryAnalyzer(None)
+        shard.load_previous_results(input_dir)
+        total_tokens += shard.total_tokens
+        for record in shard.analysis_results:
+            # 无法区分的旧版结果(标题_作者 且无诗句哈希)全部保留
+            key = record.poem_id if '#' in record.poem_id or record.content_hash else id(record)
+            current = merged.get(key)
+            if current is None or record.analysis_timestamp > current.analysis_timestamp:
+                merged[key] = record
+
+    analyzer.analysis_results = list(merged.values())
+    analyzer.processed_count = len(merged)
+    analyzer.total_tokens = total_tokens
+    print(f"合并 {len(input_dirs)} 个分片: 共 {len(merged)} 首")
+    return analyzer.save_results(output_dir)
+
+
+def _add_selection_args(parser):
+    """选择待分析诗词的公共参数"""
+    parser.add_argument('--mode', choices=['sample', 'full', 'resume'], default='sample')
+    parser.add_argument('--sample-size', type=int, default=10, help='抽样模式每个文件的抽样数量')
+    parser.add_argument('--limit', type=int, default=None, help='处理数量上限')
+    parser.add_argument('--seed', type=int, default=None, help='抽样随机种子')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--output-dir', default='analysis_output')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='只处理第 i 个分片(共 N 片)，格式 i/N，i 从0开始')
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='唐宋词花卉意象分析')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run = subparsers.add_parser('run', help='非交互分析')
+    _add_selection_args(run)
+    run.add_argument('--concurrency', type=int, default=1, help='并发请求数')
+    run.add_argument('--delay', type=float, default=1.0, help='每个请求后的间隔秒数')
+    run.add_argument('--checkpoint-every', type=int, default=20)
+    run.add_argument('--classifier', action='store_true', help='先用本地分类器预填高置信度诗词')
+    run.add_argument('--budget-tokens', type=int, default=None, help='token 预算')
+    run.add_argument('--budget-money', type=float, default=None, help='金额预算')
+    run.add_argument('--deadline', type=float, default=None, help='运行时长上限(分钟)')
+    run.add_argument('--profile', choices=['cprofile', 'sample'], default=None,
+                     help='写出性能剖析结果: cprofile(仅主线程) 或 sample(采样所有线程)')
+    run.add_argument('--resume-queue', action='store_true',
+                     help=f'只处理输出目录中 {QUEUE_FILE} 记录的剩余诗词(从全量语料中选取)')
+    run.add_argument('--api-url', default=API_URL, help='chat/completions 地址(可指向本地 mock_api_server.py)')
+    run.add_argument('--prompt-version', choices=sorted(TEMPLATES), default=DEFAULT_VERSION,
+                     help='提示词模板版本')
+    run.add_argument('--hedge', action='store_true', help='超过观测 p95 延迟时发出对冲请求')
+    run.add_argument('--hedge-ratio', type=float, default=0.1, help='对冲请求占请求总数的上限')
+
+    merge = subparsers.add_parser('merge', help='合并各分片输出')
+    merge.add_argument('input_dirs', nargs='+')
+    merge.add_argument('--output-dir', default='analysis_output')
+
+    batch_write = subparsers.add_parser('batch-write', help='生成离线批量请求文件')
+    _add_selection_args(batch_write)
+    batch_write.add_argument('--job-dir', default='batch_jobs')
+    batch_write.add_argument('--shard-size', type=int, default=10000, help='每个请求文件的行数')
+
+    reparse = subparsers.add_parser('reparse', help=f'重新解析 {FAILED_RESPONSES_FILE} 中的失败响应')
+    reparse.add_argument('--output-dir', default='analysis_output')
+
+    plan = subparsers.add_parser('plan', help='按实际语料估算费用与用时')
+    plan.add_argument('--data-dir', default='data')
+    plan.add_argument('--output-dir', default='analysis_output', help='token 统计缓存所在目录')
+    plan.add_argument('--shard', type=parse_shard, default=None)
+    plan.add_argument('--concurrency', type=int, default=1)
+    plan.add_argument('--latency', type=float, default=4.0, help='观测到的单次请求平均耗时(秒)')
+    plan.add_argument('--delay', type=float, default=1.0)
+
+    refresh = subparsers.add_parser('refresh', help='增量刷新: 只分析语料中新增或改动的诗词')
+    refresh.add_argument('--data-dir', default='data')
+    refresh.add_argument('--output-dir', default='analysis_output')
+    refresh.add_argument('--limit', type=int, default=None, help='处理数量上限')
+    refresh.add_argument('--concurrency', type=int, default=1)
+    refresh.add_argument('--delay', type=float, default=1.0)
+    refresh.add_argument('--checkpoint-every', type=int, default=20)
+    refresh.add_argument('--dry-run', action='store_true', help='只比对并作废过期结果，不调用 API')
+
+    batch_ingest = subparsers.add_parser('batch-ingest', help='回收离线批量结果文件')
+    batch_ingest.add_argument('response_files', nargs='*')
+    batch_ingest.add_argument('--job-dir', default='batch_jobs')
+    batch_ingest.add_argument('--output-dir', default='analysis_output')
+    batch_ingest.add_argument('--fake', action='store_true', help='先为请求文件生成假结果(本地测试)')
+    return parser
+
+
+def select_poems(args, analyzer):
+    """按命令行参数加载、分片并过滤待分析诗词"""
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    resume_queue = getattr(args, 'resume_queue', False)
+    queue_path = os.path.join(args.output_dir, QUEUE_FILE)
+    if resume_queue and not os.path.exists(queue_path):
+        print(f"未找到剩余队列文件: {queue_path}")
+        return []
+
+    data_loader = DataLoader(args.data_dir)
+    if args.mode == 'sample' and not resume_queue:  # 剩余队列可能在语料任意位置，需加载全量
+        poems = data_loader.load_poems(mode='sample', sample_size=args.sample_size)
+    else:
+        poems = data_loader.load_poems(mode='full')
+
+    if args.shard:
+        index, count = args.shard
+        poems = [p for p in poems if shard_of(p.poem_id, count) == index]
+        print(f"分片 {index}/{count}: {len(poems)} 首")
+
+    if args.mode == 'resume':
+        analyzed_poems, _ = analyzer.load_previous_results(args.output_dir)
+        original_count = len(poems)
+        poems = filter_analyzed(poems, analyzed_poems)
+        print(f"过滤后待分析诗词: {len(poems)}/{original_count}")
+
+    if resume_queue:
+        if args.mode != 'resume':
+            analyzer.load_previous_results(args.output_dir)
+        queued = set(load_queue(queue_path))
+        poems = [p for p in poems if p.poem_id in queued]
+        print(f"剩余队列: {len(poems)} 首")
+
+    if args.limit:
+        poems = poems[:args.limit]
+    return poems
+
+
+def run_command(args):
+    """非交互模式，API key 从环境变量 DEEPSEEK_API_KEY 读取"""
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+    if not api_key:
+        print("请设置环境变量 DEEPSEEK_API_KEY")
+        return 1
+
+    hedger = None
+    if args.hedge:
+        from hedging import HedgedRequester
+        hedger = HedgedRequester(max_ratio=args.hedge_ratio, concurrency=args.concurrency)
+    analyzer = PoetryAnalyzer(api_key, args.api_url, hedger, args.prompt_version)
+    exporter = ColumnarExporter(os.path.join(args.output_dir, 'columnar'))
+
+    poems = select_poems(args, analyzer)
+    if not poems:
+        print("empty")
+        return 0
+
+    estimate_cost(analyzer, poems, concurrency=args.concurrency, delay=args.delay)
+    if args.classifier:
+        from imagery_classifier import ImageryClassifier, MODEL_PATH
+        if not os.path.exists(MODEL_PATH):
+            print(f"未找到分类器模型 {MODEL_PATH}，请先运行 python imagery_classifier.py 训练")
+            return 1
+        try:
+            classifier = ImageryClassifier.load(MODEL_PATH)
+        except ValueError as e:
+            print(e)
+            return 1
+        prefilled, poems = classifier.triage(poems)
+        analyzer.add_results(prefilled)
+
+    scheduler = None
+    if args.budget_tokens or args.budget_money or args.deadline or args.resume_queue:
+        deadline = args.deadline * 60 if args.deadline else None
+        scheduler = BudgetScheduler(analyzer, args.budget_tokens, args.budget_money, deadline)
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    profile_prefix = os.path.join(args.output_dir, f"profile_{time.strftime('%Y%m%d_%H%M%S')}")
+    with profiled(args.profile, profile_prefix):
+        run_analysis(analyzer, poems, args.output_dir, concurrency=args.concurrency,
+                     delay=args.delay, checkpoint_every=args.checkpoint_every, exporter=exporter,
+                     scheduler=scheduler)
+    return 0
+
+
+def reparse_command(args):
+    analyzer = PoetryAnalyzer(None)
+    analyzer.load_previous_results(args.output_dir)
+    if analyzer.reparse_failed(args.output_dir):
+        analyzer.save_results(args.output_dir)
+    return 0
+
+
+def plan_command(args):
+    """预估全量语料(或某个分片)的费用与用时"""
+    from cost_planner import CostPlanner
+
+    planner = CostPlanner(PoetryAnalyzer(None), DataLoader(args.data_dir),
+                          os.path.join(args.output_dir, 'token_stats.json'))
+    planner.plan(planner.corpus_tokens(args.shard), concurrency=args.concurrency,
+                 latency=args.latency, delay=args.delay)
+    return 0
+
+
+def merge_command(args):
+    merge_results(args.input_dirs, args.output_dir)
+    return 0
+
+
+def refresh_command(args):
+    """增量刷新: 比对语料指纹，作废文本已改变的结果，只分析新增或改动的诗词"""
+    from corpus_refresh import CorpusRefresher
+
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+    if not api_key and not args.dry_run:
+        print("请设置环境变量 DEEPSEEK_API_KEY")
+        return 1
+
+    analyzer = PoetryAnalyzer(api_key)
+    analyzer.load_previous_results(args.output_dir)
+    refresher = CorpusRefresher(analyzer, DataLoader(args.data_dir), args.output_dir)
+    poems, changed = refresher.refresh()
+    exporter = ColumnarExporter(os.path.join(args.output_dir, 'columnar'))
+    if changed:
+        analyzer.save_results(args.output_dir)
+        analyzer.export_columnar(exporter)
+
+    if args.limit:
+        poems = poems[:args.limit]
+    if poems and not args.dry_run:
+        run_analysis(analyzer, poems, args.output_dir, concurrency=args.concurrency,
+                     delay=args.delay, checkpoint_every=args.checkpoint_every, exporter=exporter)
+    # 分析之后再写指纹，未完成的文件下次刷新时继续
+    refresher.save()
+    return 0
+
+
+def batch_write_command(args):
+    """离线模式: 生成批量请求文件"""
+    analyzer = PoetryAnalyzer(None)
+    poems = select_poems(args, analyzer)
+    if not poems:
+        print("empty")
+        return 0
+    BatchJobWriter(analyzer, args.job_dir, args.shard_size).write(poems)
+    return 0
+
+
+def batch_ingest_command(args):
+    """离线模式: 回收批量结果，追加到输出目录中的最新结果"""
+    analyzer = PoetryAnalyzer(None)
+    analyzer.load_previous_results(args.output_dir)
+
+    response_files = list(args.response_files)
+    if args.fake:
+        response_files.extend(write_fake_responses(args.job_dir))
+    if not response_files:
+        print("未指定结果文件")
+        return 1
+
+    ingester = BatchIngester(analyzer, args.job_dir)
+    success_count, _ = ingester.ingest(response_files)
+    if success_count:
+        analyzer.save_results(args.output_dir)
+        analyzer.export_columnar(ColumnarExporter(os.path.join(args.output_dir, 'columnar')))
+    return 0
+
+
+COMMANDS = {
+    'run': run_command,
+    'merge': merge_command,
+    'reparse': reparse_command,
+    'plan': plan_command,
+    'refresh': refresh_command,
+    'batch-write': batch_write_command,
+    'batch-ingest': batch_ingest_command,
+}
+
+
 def main():
     """主函数"""
+    if len(sys.argv) > 1:
+        args = build_arg_parser().parse_args()
+        return COMMANDS[args.command](args)
 
+    # 无参数时进入交互模式
     # API密钥配置
-    API_KEY = "sk-5176c49ed09c4af98b5ee37598df4f91"
+    API_KEY = os.environ.get('DEEPSEEK_API_KEY') or input("请输入 DeepSeek API key: ").strip()
 
     # 初始化分析器和数据加载器
     analyzer = PoetryAnalyzer(API_KEY)
     data_loader = DataLoader('data')
+    exporter = ColumnarExporter('analysis_output/columnar')
 
     # 扫描数据库
-    stats, total_poems_estimate = data_loader.scan_databases()
+    data_loader.scan_databases()
 
     # 选择分析模式
     print("\n分析模式:")
@@ -331,15 +972,12 @@ def main():
         # 抽样分析模式
         sample_size = int(input("请输入抽样数量 (默认10): ") or "10")
         poems = data_loader.load_poems(mode='sample', sample_size=sample_size)
-        calculate_cost_estimate(sample_size)
 
     elif choice == '2':
         # 完整分析模式
         limit = input("请输入处理数量限制 (enter表示无限制): ").strip()
         limit = int(limit) if limit else None
         poems = data_loader.load_poems(mode='full', limit=limit)
-        poems_count = limit if limit else total_poems_estimate
-        calculate_cost_estimate(poems_count)
 
     elif choice == '3':
         # 继续分析
@@ -348,7 +986,7 @@ def main():
 
         # 过滤掉已分析的诗词
         original_count = len(poems)
-        poems = [p for p in poems if f"{p['title']}_{p['author']}" not in analyzed_poems]
+        poems = filter_analyzed(poems, analyzed_poems)
         print(f"过滤后待分析诗词: {len(poems)}/{original_count}")
 
     else:
@@ -359,61 +997,34 @@ def main():
         print("empty")
         return
 
-    # 开始分析
-    print(f"\n开始诗词分析...")
-    print(f"目标分析数量: {len(poems)} 首")
-
-    success_count = 0
-    start_time = time.time()
-
-    for i, poem in enumerate(poems, 1):
-        print(f"\n进度: {i}/{len(poems)}")
-        print(f"诗词: 《{poem['title']}》 - {poem['author']}")
-
-        if analyzer.analyze_poem(poem):
-            success_count += 1
-            print("分析成功")
-        else:
-            print("分析失败")
+    # 按实际加载的诗词估算
+    estimate_cost(analyzer, poems)
 
-        # 每分析20首保存一次(or 10)
-        #速度估算器
-        if i % 20 == 0:
-            analyzer.save_results()
-            elapsed_time = time.time() - start_time
-            poems_per_minute = i / (elapsed_time / 60)
-            print(f"已保存检查点 | 速度: {poems_per_minute:.1f} 首/分钟")
+    # 本地分类器分流(需先运行 imagery_classifier.py 训练)
+    classifier_path = os.path.join('analysis_output', 'imagery_classifier.npz')
+    if os.path.exists(classifier_path):
+        if input("使用本地分类器预填高置信度诗词? (y/N): ").strip().lower() == 'y':
+            from imagery_classifier import ImageryClassifier
+            try:
+                prefilled, poems = ImageryClassifier.load(classifier_path).triage(poems)
+                analyzer.analysis_results.extend(prefilled)
+            except ValueError as e:
+                print(e)
 
-        # 请求间隔
-        time.sleep(1)
+    success_count, final_file = run_analysis(analyzer, poems, exporter=exporter)
 
-    # 最终保存
     if success_count > 0:
-        final_file = analyzer.save_results()
-
-        # 分析统计
-        elapsed_time = time.time() - start_time
-
-
-        print(f"\n分析完成统计:")
-        print(f"总处理诗词: {analyzer.processed_count}")
-        print(f"成功分析: {success_count}")
-        print(f"成功率: {(success_count/len(poems))*100:.1f}%")
-        print(f"总用时: {elapsed_time/60:.1f} 分钟")
-        print(f"结果文件: {final_file}")
-
         # 样本结果
         print(f"\n样本分析结果:")
+        contents = {poem.poem_id: poem.content for poem in poems}
         for result in analyzer.analysis_results[:3]:
-            analysis = result['analysis']
-            print(f"《{result['title']}》 - {result['author']}")
-            print(f"  诗句: {result['content'][:50]}...")
+            analysis = result.analysis
+            print(f"《{result.title}》 - {result.author}")
+            print(f"  诗句: {contents.get(result.poem_id, '')[:50]}...")
             print(f"  创作年代: {analysis['date']}")
             print(f"  相关花卉: {analysis['flower']}")
             print(f"  意象标签: {', '.join(analysis['imagery'])}")
-    else:
-        print("none")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+本地模拟 chat/completions 接口，用于验证并发、对冲请求与提示词前缀缓存
+按给定概率注入延迟尖刺；按 64 字符为单位模拟前缀缓存(以字符数代替 token 数):
+    python mock_api_server.py --port 8765 --latency 0.2 --spike-rate 0.05 --spike-latency 10
+    DEEPSEEK_API_KEY=x python json_poem_analyzer.py run --api-url http://127.0.0.1:8765/v1/chat/completions --hedge
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """返回固定分析结果，延迟由 server 上的参数决定"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        prompt = ''.join(f"{m.get('role')}:{m.get('content', '')}\n" for m in body.get('messages', []))
+
+        server = self.server
+        spike = random.random() < server.spike_rate
+        time.sleep(server.spike_latency if spike else random.uniform(0.5, 1.5) * server.latency)
+        with server.lock:
+            server.served += 1
+            server.spikes += spike
+            hit_tokens = self._cached_prefix(prompt)
+
+        content = json.dumps({"date": 1100, "flower": "梅花", "imagery": ["梅花", "春"]}, ensure_ascii=False)
+        prompt_tokens = len(prompt)
+        payload = {
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 20,
+                      'total_tokens': prompt_tokens + 20,
+                      'prompt_cache_hit_tokens': hit_tokens,
+                      'prompt_cache_miss_tokens': prompt_tokens - hit_tokens}
+        }
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端已作废该请求
+
+    def _cached_prefix(self, prompt, unit=64):
+        """已见过的最长前缀长度(按 unit 取整)，并记录本次的各级前缀"""
+        cache = self.server.prefix_cache
+        hit = 0
+        for end in range(unit, len(prompt) + 1, unit):
+            prefix = prompt[:end]
+            if prefix in cache:
+                hit = end
+            else:
+                cache.add(prefix)
+        return hit
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=8765, latency=0.2, spike_rate=0.05, spike_latency=10.0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.spike_rate = spike_rate
+    server.spike_latency = spike_latency
+    server.lock = threading.Lock()
+    server.served = 0
+    server.spikes = 0
+    server.prefix_cache = set()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='正常延迟(秒)')
+    parser.add_argument('--spike-rate', type=float, default=0.05, help='延迟尖刺概率')
+    parser.add_argument('--spike-latency', type=float, default=10.0, help='尖刺延迟(秒)')
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency, args.spike_rate, args.spike_latency)
+    print(f"模拟接口: http://127.0.0.1:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n共响应 {server.served} 次, 其中尖刺 {server.spikes} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+同文去重
+同一首诗常出现在多个来源(唐诗三百首 与 poet.tang.*、宋词三百首 与 ci.song.* 等)，
+按规范化文本哈希分组，每组只调用一次 API，结果复制给组内其他来源
+"""
+
+import time
+from collections import defaultdict
+
+from poem_records import AnalysisRecord
+
+
+class ContentDeduper:
+    """按 content_hash 去重并分发结果"""
+
+    def __init__(self):
+        self.duplicates = defaultdict(list)  # 代表 poem_id -> 同文的其他诗词
+        self.known = {}  # content_hash -> 已有分析结果
+        self.reused = 0
+        self.released = 0  # 代表诗词失败而退回的同文诗词数
+
+    def dedup(self, poems, previous_results=()):
+        """
+        Args:
+            poems (list): 待分析的 PoemRecord
+            previous_results: 已有的 AnalysisRecord，同文诗词直接复用
+        Returns:
+            (需调用 API 的诗词, 直接复用已有结果生成的 AnalysisRecord)
+        """
+        for record in previous_results:
+            if record.content_hash and record.method != 'dedup':
+                self.known.setdefault(record.content_hash, record)
+
+        unique = []
+        representatives = {}
+        reused_records = []
+        for poem in poems:
+            key = poem.content_hash
+            if key in self.known:
+                reused_records.append(self._copy(self.known[key], poem))
+                continue
+            representative = representatives.get(key)
+            if representative is None:
+                representatives[key] = poem
+                unique.append(poem)
+            else:
+                self.duplicates[representative.poem_id].append(poem)
+
+        self.reused += len(reused_records)
+        print(f"同文去重: {len(poems)} 首 -> 需分析 {len(unique)} 首, "
+              f"同文待复用 {self.pending_count()} 首, 复用已有结果 {len(reused_records)} 首")
+        return unique, reused_records
+
+    def pending_count(self):
+        return sum(len(v) for v in self.duplicates.values())
+
+    def fan_out(self, record):
+        """将代表诗词的分析结果复制给同文的其他来源"""
+        copies = [self._copy(record, poem) for poem in self.duplicates.pop(record.poem_id, [])]
+        self.reused += len(copies)
+        return copies
+
+    def release(self, poem_id):
+        """代表诗词分析失败: 退回其同文诗词(计入失败与剩余队列，下次与代表一并重新分组)"""
+        released = self.duplicates.pop(poem_id, [])
+        self.released += len(released)
+        return released
+
+    def remaining(self):
+        """尚未分发结果的同文诗词(代表未派发或未完成)"""
+        return [poem for poems in self.duplicates.values() for poem in poems]
+
+    def _copy(self, record, poem):
+        return AnalysisRecord.from_poem(poem, record.analysis, time.time(), method='dedup')
+
+    def report(self):
+        print(f"同文去重节省 API 调用: {self.reused} 次")
+        if self.released:
+            print(f"代表诗词失败，同文诗词未分析: {self.released} 首")
+        return self.reused
@@ -0,0 +1,160 @@
+"""
+诗词与分析结果的紧凑记录类型
+使用 __slots__ 取代每首诗一个 dict，作者名与来源文件名统一驻留(intern)，
+分析结果只通过 poem_id 引用原诗，不再复制全文
+"""
+
+import hashlib
+import re
+import sys
+import zlib
+
+try:
+    import opencc
+    _to_simplified = opencc.OpenCC('t2s').convert
+except ImportError:  # 无 opencc 时不做繁简转换
+    _to_simplified = None
+
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def intern_str(value):
+    """驻留字符串，重复出现的作者/文件名共享同一对象"""
+    return sys.intern(str(value))
+
+
+def normalize_content(content):
+    """去除标点空白并转为简体，用于判断是否同一文本"""
+    text = _NON_WORD.sub('', content)
+    if _to_simplified:
+        text = _to_simplified(text)
+    return text
+
+
+def shard_of(poem_id, shard_count):
+    """按稳定ID哈希分片(与进程、机器无关)"""
+    return zlib.crc32(poem_id.encode('utf-8')) % shard_count
+
+
+def content_hash(content):
+    """规范化文本的哈希"""
+    return hashlib.blake2b(normalize_content(content).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def legacy_id(title, author, digest=''):
+    """旧版结果(无 来源文件#序号)的ID: 标题_作者，有诗句哈希时为 标题_作者@哈希"""
+    return f"{title}_{author}@{digest}" if digest else f"{title}_{author}"
+
+
+class PoemRecord:
+    """单首诗词记录"""
+
+    __slots__ = ('title', 'author', 'content', 'source_file', 'index', 'rhythmic', '_content_hash',
+                 'legacy_title')
+
+    def __init__(self, title, author, content, source_file, index, rhythmic=None, content_hash=None,
+                 legacy_title=None):
+        self.title = title
+        self.author = intern_str(author)
+        self.content = content
+        self.source_file = intern_str(source_file)
+        self.index = index  # 在来源文件中的位置
+        self.rhythmic = intern_str(rhythmic) if rhythmic else None  # 词牌(仅宋词)
+        self._content_hash = content_hash
+        self.legacy_title = legacy_title  # 旧版键使用的标题(宋词无标题时为 无题)，None 表示与 title 相同
+
+    @property
+    def poem_id(self):
+        """稳定ID: 来源文件名#文件内序号"""
+        return f"{self.source_file}#{self.index}"
+
+    @property
+    def content_hash(self):
+        if self._content_hash is None:
+            self._content_hash = content_hash(self.content)
+        return self._content_hash
+
+    def legacy_key(self):
+        """旧版结果文件使用的 标题_作者 键"""
+        return f"{self.legacy_title or self.title}_{self.author}"
+
+    def to_dict(self):
+        return {
+            'poem_id': self.poem_id,
+            'title': self.title,
+            'author': self.author,
+            'content': self.content,
+            'source_file': self.source_file,
+            'rhythmic': self.rhythmic
+        }
+
+    def __repr__(self):
+        return f"PoemRecord({self.poem_id!r}, {self.title!r}, {self.author!r})"
+
+
+class AnalysisRecord:
+    """单条分析结果，只引用 poem_id，不保存诗词全文"""
+
+    __slots__ = ('poem_id', 'title', 'author', 'source_file',
+                 'date', 'flower', 'imagery', 'analysis_timestamp', 'method', 'content_hash')
+
+    def __init__(self, poem_id, title, author, source_file,
+                 date, flower, imagery, analysis_timestamp, method='llm', content_hash=''):
+        self.poem_id = poem_id
+        self.title = title
+        self.author = intern_str(author)
+        self.source_file = intern_str(source_file)
+        self.date = date
+        self.flower = intern_str(flower)
+        self.imagery = tuple(intern_str(tag) for tag in imagery)
+        self.analysis_timestamp = analysis_timestamp
+        self.method = method  # llm: API分析; classifier: 本地分类器预填; dedup: 同文复用
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_poem(cls, poem, analysis, timestamp, method='llm'):
+        """由诗词记录和标准化分析结果构建"""
+        return cls(poem.poem_id, poem.title, poem.author, poem.source_file,
+                   analysis['date'], analysis['flower'], analysis['imagery'], timestamp, method,
+                   poem.content_hash)
+
+    @classmethod
+    def from_dict(cls, data):
+        """从结果文件中的一条记录恢复(兼容旧版含 content 的格式)"""
+        analysis = data.get('analysis', {})
+        title, author = data.get('title', '无题'), data.get('author', '未知')
+        # 旧版记录丢弃全文前先算出 content_hash，供去重复用与增量刷新比对
+        digest = data.get('content_hash') or (content_hash(data['content']) if data.get('content') else '')
+        poem_id = data.get('poem_id') or ''
+        if '#' not in poem_id:
+            # 旧版 标题_作者 不唯一(如多首 无题_苏轼)，带上诗句哈希区分
+            poem_id = legacy_id(title, author, digest)
+        return cls(poem_id, title, author,
+                   data.get('source_file', ''),
+                   analysis.get('date', 0), analysis.get('flower', '无'),
+                   analysis.get('imagery', []), data.get('analysis_timestamp', 0),
+                   data.get('method', 'llm'), digest)
+
+    @property
+    def analysis(self):
+        return {
+            'date': self.date,
+            'flower': self.flower,
+            'imagery': list(self.imagery)
+        }
+
+    def legacy_key(self):
+        return f"{self.title}_{self.author}"
+
+    def to_dict(self):
+        return {
+            'poem_id': self.poem_id,
+            'title': self.title,
+            'author': self.author,
+            'analysis': self.analysis,
+            'source_file': self.source_file,
+            'analysis_timestamp': self.analysis_timestamp,
+            'method': self.method,
+            'content_hash': self.content_hash
+        }
@@ -0,0 +1,85 @@
+"""
+版本化的分析提示词模板
+服务端前缀缓存只对逐字节相同的前缀生效：system 指令与 few-shot 示例放在前面且完全固定，
+诗句作为最后一条消息追加；模板一经发布不再修改，改动只能新增版本
+"""
+
+import json
+
+
+# few-shot 示例: (诗句, 期望输出)
+_EXAMPLES = [
+    ("墙角数枝梅，凌寒独自开。遥知不是雪，为有暗香来。",
+     {"date": 1076, "flower": "梅花", "imagery": ["梅花", "凌寒", "暗香", "高洁"]}),
+    ("昨夜雨疏风骤，浓睡不消残酒。试问卷帘人，却道海棠依旧。知否，知否？应是绿肥红瘦。",
+     {"date": 1100, "flower": "海棠", "imagery": ["海棠", "风雨", "惜春", "闺情"]}),
+    ("床前明月光，疑是地上霜。举头望明月，低头思故乡。",
+     {"date": 726, "flower": "无", "imagery": ["明月", "霜", "思乡"]}),
+]
+
+_SYSTEM_V2 = """你是中国古典诗词研究助手。用户每次给出一首诗词，请分析后只输出一个JSON对象，不要输出其他文字。
+
+字段要求：
+1. date: 创作年代，公元纪年的整数，公元前用负值；无法确定时给出作者生活的大致年份
+2. flower: 诗中最主要的花卉，使用完整名称(如 梅花、菊花、莲花)；没有花卉时写"无"
+3. imagery: 核心意象标签数组，2到6个中文关键词
+
+输出格式：
+{"date": 年代, "flower": "花卉", "imagery": ["意象1", "意象2"]}"""
+
+
+def _legacy_messages(content):
+    """v1: 原提示词，诗句位于指令中间(仅用于对比)"""
+    prompt = f"""请分析以下诗歌并输出JSON格式结果：
+
+{content}
+
+要求：
+1. 分析创作年代（公元纪年，公元前用负值）
+2. 识别相关花卉
+3. 提取核心意象标签
+
+输出格式：
+{{"date": 年代, "flower": "花卉", "imagery": ["意象1", "意象2"]}}"""
+    return [{"role": "user", "content": prompt}]
+
+
+def _build_prefix_v2():
+    messages = [{"role": "system", "content": _SYSTEM_V2}]
+    for poem, answer in _EXAMPLES:
+        messages.append({"role": "user", "content": poem})
+        messages.append({"role": "assistant", "content": json.dumps(answer, ensure_ascii=False)})
+    return messages
+
+
+_PREFIX_V2 = _build_prefix_v2()
+
+
+def _cached_prefix_messages(content):
+    """v2: 固定前缀 + 诗句"""
+    return _PREFIX_V2 + [{"role": "user", "content": content}]
+
+
+TEMPLATES = {
+    'v1': _legacy_messages,
+    'v2': _cached_prefix_messages,
+}
+
+DEFAULT_VERSION = 'v2'
+
+
+def build_messages(content, version=DEFAULT_VERSION):
+    """
+    Returns:
+        chat/completions 的 messages 列表
+    """
+    try:
+        template = TEMPLATES[version]
+    except KeyError:
+        raise ValueError(f"未知的提示词版本: {version}，可选 {', '.join(TEMPLATES)}")
+    return template(content)
+
+
+def messages_text(messages):
+    """messages 的文本内容(用于估算 token)"""
+    return ''.join(m['content'] for m in messages)
@@ -0,0 +1,263 @@
+"""
+分析结果的只读查询服务
+启动时加载一次最新结果文件，建立 poem_id / 作者 / 花卉 / 年代 索引；
+之后按字节偏移增量读取结果日志(results_journal.jsonl)热更新，不再重新解析整个结果文件
+
+    python query_service.py --output-dir analysis_output --port 8080
+    GET /poems/<poem_id>                                 (poem_id 中的 # 写作 %23)
+    GET /poems?author=苏轼&flower=梅花&year_from=1070&year_to=1100&offset=0&limit=50
+    GET /stats
+"""
+
+import argparse
+import json
+import os
+import threading
+from bisect import bisect_left, insort
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from poem_records import AnalysisRecord
+from result_export import JOURNAL_FILE, latest_results_file
+
+
+MAX_PAGE_SIZE = 500
+
+
+class ResultIndex:
+    """内存索引，写入(加载/热更新)与查询由同一把锁保护"""
+
+    def __init__(self, output_dir='analysis_output'):
+        self.output_dir = output_dir
+        self.journal_path = os.path.join(output_dir, JOURNAL_FILE)
+        self.lock = threading.Lock()
+        self.journal_offset = 0
+        self._clear()
+
+    def _clear(self):
+        self.by_id = {}  # 索引键 -> 结果，索引键通常即 poem_id
+        self.by_author = {}
+        self.by_flower = {}
+        self.by_year = []  # 按 (年代, 索引键) 排序
+        self.aliases = {}  # poem_id -> 同名旧版结果的其他索引键
+
+    def _key(self, record):
+        """
+        索引键: 无法区分的旧版结果(标题_作者 且无诗句哈希)重名时加序号 ~2、~3…，不互相覆盖；
+        其余结果同 poem_id 即替换
+        """
+        poem_id = record.poem_id
+        if '#' in poem_id or record.content_hash or poem_id not in self.by_id:
+            return poem_id
+        aliases = self.aliases.setdefault(poem_id, [])
+        key = f"{poem_id}~{len(aliases) + 2}"
+        aliases.append(key)
+        return key
+
+    def _index(self, key, record):
+        self.by_id[key] = record
+        self.by_author.setdefault(record.author, set()).add(key)
+        self.by_flower.setdefault(record.flower, set()).add(key)
+
+    def _add(self, record):
+        key = self._key(record)
+        if key in self.by_id:
+            self._remove(key)
+        self._index(key, record)
+        insort(self.by_year, (record.date, key))
+
+    def _remove(self, poem_id):
+        """作废 poem_id 的结果(连同同名旧版结果)"""
+        for key in [poem_id] + self.aliases.pop(poem_id, []):
+            record = self.by_id.pop(key, None)
+            if record is None:
+                continue
+            self.by_author[record.author].discard(key)
+            self.by_flower[record.flower].discard(key)
+            entry = (record.date, key)
+            i = bisect_left(self.by_year, entry)
+            if i < len(self.by_year) and self.by_year[i] == entry:
+                del self.by_year[i]
+
+    def load(self):
+        """
+        全量加载: 先记下日志当前长度再读结果文件，
+        结果文件已包含此前写入日志的全部记录(保存时先写结果文件再追加日志)
+        """
+        offset = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        records = []
+        latest_file = latest_results_file(self.output_dir)
+        if latest_file:
+            with open(latest_file, 'r', encoding='utf-8') as f:
+                records = [AnalysisRecord.from_dict(r) for r in json.load(f).get('results', [])]
+
+        with self.lock:
+            self._clear()
+            for record in records:
+                self._index(self._key(record), record)
+            self.by_year = sorted((r.date, key) for key, r in self.by_id.items())
+            self.journal_offset = offset
+        print(f"已加载 {len(records)} 条结果: {os.path.basename(latest_file) if latest_file else '无'}")
+        self.poll()
+
+    def poll(self):
+        """读取日志新增的完整行，返回应用的行数"""
+        if not os.path.exists(self.journal_path):
+            return 0
+        size = os.path.getsize(self.journal_path)
+        if size < self.journal_offset:  # 日志被截断或替换
+            self.load()
+            return 0
+        if size == self.journal_offset:
+            return 0
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.journal_offset)
+            data = f.read(size - self.journal_offset)
+        end = data.rfind(b'\n') + 1  # 末尾未写完的行留到下次
+        if not end:
+            return 0
+
+        lines = data[:end].decode('utf-8').splitlines()
+        with self.lock:
+            for line in lines:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get('reset'):
+                    self._clear()
+                elif entry.get('removed'):
+                    self._remove(entry['poem_id'])
+                else:
+                    self._add(AnalysisRecord.from_dict(entry))
+            self.journal_offset += end
+        return len(lines)
+
+    def get(self, poem_id):
+        with self.lock:
+            return self.by_id.get(poem_id)
+
+    def query(self, author=None, flower=None, year_from=None, year_to=None, offset=0, limit=50):
+        """
+        组合条件查询，按 (年代, poem_id) 排序分页
+        Returns:
+            (命中总数, 当前页 AnalysisRecord 列表)
+        """
+        with self.lock:
+            sets = []
+            if author is not None:
+                sets.append(self.by_author.get(author, set()))
+            if flower is not None:
+                sets.append(self.by_flower.get(flower, set()))
+
+            if not sets:
+                # 只按年代: 直接在有序数组上切片
+                lo = 0 if year_from is None else bisect_left(self.by_year, (year_from,))
+                hi = len(self.by_year) if year_to is None else bisect_left(self.by_year, (year_to + 1,))
+                total = max(hi - lo, 0)
+                keys = self.by_year[lo + offset:min(lo + offset + limit, hi)]
+            else:
+                # 从最小的集合出发求交集
+                sets.sort(key=len)
+                keys = []
+                for pid in sets[0].intersection(*sets[1:]):
+                    date = self.by_id[pid].date
+                    if (year_from is None or date >= year_from) and (year_to is None or date <= year_to):
+                        keys.append((date, pid))
+                keys.sort()
+                total = len(keys)
+                keys = keys[offset:offset + limit]
+            return total, [self.by_id[pid] for _, pid in keys]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'results': len(self.by_id),
+                'authors': sum(1 for ids in self.by_author.values() if ids),
+                'flowers': {name: len(ids) for name, ids in self.by_flower.items() if ids},
+                'journal_offset': self.journal_offset
+            }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        index = self.server.index
+        try:
+            if url.path == '/stats':
+                return self._send(200, index.stats())
+            if url.path.startswith('/poems/'):
+                record = index.get(unquote(url.path[len('/poems/'):]))
+                if record is None:
+                    return self._send(404, {'error': 'not found'})
+                return self._send(200, record.to_dict())
+            if url.path == '/poems':
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                offset = max(int(params.get('offset', 0)), 0)
+                limit = min(max(int(params.get('limit', 50)), 0), MAX_PAGE_SIZE)
+                total, records = index.query(
+                    author=params.get('author'), flower=params.get('flower'),
+                    year_from=int(params['year_from']) if 'year_from' in params else None,
+                    year_to=int(params['year_to']) if 'year_to' in params else None,
+                    offset=offset, limit=limit)
+                return self._send(200, {'total': total, 'offset': offset, 'limit': limit,
+                                        'results': [r.to_dict() for r in records]})
+            return self._send(404, {'error': 'not found'})
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(index, host='127.0.0.1', port=8080):
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.index = index
+    return server
+
+
+def watch(index, interval, stop):
+    """后台轮询结果日志"""
+    while not stop.wait(interval):
+        try:
+            applied = index.poll()
+        except (OSError, ValueError) as e:
+            print(f"读取结果日志失败: {e}")
+            continue
+        if applied:
+            print(f"热更新 {applied} 条, 当前共 {len(index.by_id)} 条结果")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析结果查询服务')
+    parser.add_argument('--output-dir', default='analysis_output')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--poll', type=float, default=2.0, help='检查结果日志的间隔(秒)')
+    args = parser.parse_args()
+
+    index = ResultIndex(args.output_dir)
+    index.load()
+    stop = threading.Event()
+    threading.Thread(target=watch, args=(index, args.poll, stop), daemon=True).start()
+
+    server = make_server(index, args.host, args.port)
+    print(f"查询服务: http://{args.host}:{args.port}/poems")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
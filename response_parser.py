@@ -0,0 +1,152 @@
+"""
+API 响应的 JSON 解析与修复
+PoetryAnalyzer 与 BAfirstTry 共用：先直接 json.loads，失败后从第一个 { 解码一个完整对象(忽略前后说明文字)，
+仍失败时截取花括号并修复中文标点、单引号、尾逗号、Python 字面量和未加引号的值(如 公元1070年)
+返回 (结果, 类别)，类别用于统计解析失败原因
+"""
+
+import json
+import re
+
+
+# 解析类别
+PARSE_OK = 'ok'                  # 直接解析成功
+PARSE_EXTRACTED = 'extracted'    # 去掉前后说明文字后成功
+PARSE_REPAIRED = 'repaired'      # 修复后成功
+PARSE_EMPTY = 'empty'            # 空响应
+PARSE_NO_JSON = 'no_json'        # 找不到 {
+PARSE_INVALID = 'invalid_json'   # 修复后仍无法解析
+PARSE_NOT_OBJECT = 'not_object'  # 解析结果不是对象
+
+FAILED_CATEGORIES = (PARSE_EMPTY, PARSE_NO_JSON, PARSE_INVALID, PARSE_NOT_OBJECT)
+
+# 字符串外的全角结构符号
+_STRUCTURAL = {'，': ',', '：': ':', '｛': '{', '｝': '}', '［': '[', '］': ']', '【': '[', '】': ']'}
+
+# 引号 -> 可结束该字符串的引号
+_QUOTES = {'"': '"', '“': '”"', "'": "'", '‘': "’'"}
+
+_BARE_END = set(',:}]\n，：｝］】')
+
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null'}
+
+_NUMBER = re.compile(r'-?\d+(\.\d+)?')
+
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def strip_code_fence(text):
+    return text.replace('```json', '').replace('```', '').strip()
+
+
+def extract_braces(text):
+    """截取第一个 { 到最后一个 } 之间的内容"""
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1:
+        return None
+    if end < start:
+        return text[start:]  # 响应被截断，由 repair_json 补全括号
+    return text[start:end + 1]
+
+
+def repair_json(text):
+    """逐字符扫描修复常见的非标准 JSON，末尾未闭合的括号自动补全"""
+    out = []
+    stack = []
+    i = 0
+    n = len(text)
+    while i < n:
+        ch = text[i]
+
+        if ch in _QUOTES:
+            closers = _QUOTES[ch]
+            j = i + 1
+            buf = []
+            while j < n and text[j] not in closers:
+                if text[j] == '\\' and j + 1 < n:
+                    buf.append(text[j:j + 2])
+                    j += 2
+                    continue
+                buf.append('\\"' if text[j] == '"' else text[j])
+                j += 1
+            out.append('"' + ''.join(buf) + '"')
+            i = j + 1
+            continue
+
+        if ch in _STRUCTURAL or ch.isspace() or ch in ',:{}[]':
+            ch = _STRUCTURAL.get(ch, ch)
+            if ch in '{[':
+                stack.append('}' if ch == '{' else ']')
+            elif ch in '}]' and stack:
+                stack.pop()
+                if not stack:
+                    out.append(ch)
+                    break  # 最外层已闭合，之后的说明文字(可能含花括号)丢弃
+            out.append(ch)
+            i += 1
+            continue
+
+        # 裸值: 数字、字面量或未加引号的文本
+        j = i
+        while j < n and text[j] not in _BARE_END:
+            j += 1
+        word = text[i:j].rstrip()
+        if word in _LITERALS:
+            out.append(_LITERALS[word])
+        elif _NUMBER.fullmatch(word):
+            out.append(word)
+        else:
+            out.append(json.dumps(word, ensure_ascii=False))
+        out.append(text[i + len(word):j])
+        i = j
+
+    repaired = ''.join(out)
+    if stack:
+        repaired = repaired.rstrip().rstrip(',') + ''.join(reversed(stack))
+    return _TRAILING_COMMA.sub(r'\1', repaired)
+
+
+def _as_object(value):
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], dict):
+        return value[0]
+    return None
+
+
+def parse_response(text):
+    """
+    解析模型响应
+    Returns:
+        (dict 或 None, 类别)
+    """
+    if not text or not text.strip():
+        return None, PARSE_EMPTY
+    text = strip_code_fence(text)
+
+    # 快速路径
+    try:
+        value = json.loads(text)
+        result = _as_object(value)
+        return (result, PARSE_OK) if result is not None else (None, PARSE_NOT_OBJECT)
+    except ValueError:
+        pass
+
+    fragment = extract_braces(text)
+    if fragment is None:
+        return None, PARSE_NO_JSON
+
+    # 从第一个 { 解码一个完整对象，其后的说明文字(如 注：{年代不确定})不影响
+    try:
+        value, _ = json.JSONDecoder().raw_decode(fragment)
+        return value, PARSE_EXTRACTED
+    except ValueError:
+        pass
+
+    try:
+        result = _as_object(json.loads(repair_json(fragment)))
+    except ValueError:
+        return None, PARSE_INVALID
+    return (result, PARSE_REPAIRED) if result is not None else (None, PARSE_NOT_OBJECT)
@@ -0,0 +1,249 @@
+"""
+分析结果的列式增量导出
+有 pyarrow 时写 Parquet，否则写 CSV 分块；作者名统一编号写入字典文件
+每个分块即一个 row group，写满 chunk_size 行才开始下一块；未满的末块在检查点时整体重写
+作废的结果记入 removed.json(poem_id -> 作废时的块号)，读取时跳过此前各块中的旧行；
+未加载旧结果的新一轮分析开始新一代导出(清空分块)
+另有只追加的结果日志(JSONL)，供查询服务按字节偏移增量读取
+"""
+
+import csv
+import glob
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 无 pyarrow 时退回 CSV
+    pa = None
+    pq = None
+
+
+# 稳定的导出 schema(列名, 类型)
+SCHEMA = [
+    ('poem_id', 'string'),
+    ('author_id', 'int32'),
+    ('year', 'int32'),
+    ('flower', 'string'),
+    ('imagery', 'list<string>'),
+]
+
+IMAGERY_SEPARATOR = '|'  # CSV 中意象列表的分隔符
+
+REMOVED_FILE = 'removed.json'  # 作废结果: poem_id -> 作废时的块号
+
+RESULTS_PATTERN = 'poetry_analysis_*.json'
+
+JOURNAL_FILE = 'results_journal.jsonl'  # 每次保存检查点时追加的新结果
+
+
+def latest_results_file(output_dir):
+    """按文件名中的时间戳取最新的结果文件(不依赖 ctime，复制或同步后仍然正确)"""
+    files = glob.glob(os.path.join(output_dir, RESULTS_PATTERN))
+    if not files:
+        return None
+    return max(files, key=os.path.basename)
+
+
+def append_journal(output_dir, records, removed_ids=(), reset=False):
+    """
+    追加写出结果日志，每行一条:
+        {"reset": true}                  此前的结果全部作废(未加载旧结果的新一轮分析)
+        {"poem_id": ..., "removed": true} 作废单条结果
+        AnalysisRecord.to_dict()          新增或更新
+    """
+    lines = []
+    if reset:
+        lines.append(json.dumps({'reset': True}))
+    lines.extend(json.dumps({'poem_id': pid, 'removed': True}, ensure_ascii=False) for pid in removed_ids)
+    lines.extend(json.dumps(record.to_dict(), ensure_ascii=False) for record in records)
+    if not lines:
+        return 0
+    with open(os.path.join(output_dir, JOURNAL_FILE), 'a', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return len(lines)
+
+
+class ColumnarExporter:
+    """按分块追加写出分析结果"""
+
+    def __init__(self, output_dir='analysis_output/columnar', chunk_size=5000, use_parquet=None):
+        self.output_dir = output_dir
+        self.chunk_size = chunk_size
+        self.use_parquet = (pq is not None) if use_parquet is None else use_parquet
+        if self.use_parquet and pq is None:
+            raise ImportError("写出 Parquet 需要安装 pyarrow")
+        self.dictionary_path = os.path.join(output_dir, 'dictionary.json')
+        self.removed_path = os.path.join(output_dir, REMOVED_FILE)
+        self.buffer = []  # 当前末块的行(未满 chunk_size)
+        self.author_ids = {}
+        self.authors = []
+        self.generation = 0
+        self.removed = {}
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        self._load_dictionary()
+        self._load_removed()
+        # 上次运行未满的末块保持原样，本次从新块开始
+        self.part_index = len(self._part_files())
+
+    def _extension(self):
+        return 'parquet' if self.use_parquet else 'csv'
+
+    def _part_files(self):
+        return sorted(glob.glob(os.path.join(self.output_dir, f'part-*.{self._extension()}')))
+
+    def _load_dictionary(self):
+        """读取已有字典，保证追加时作者编号不变"""
+        if not os.path.exists(self.dictionary_path):
+            return
+        with open(self.dictionary_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.authors = data.get('authors', [])
+        self.author_ids = {name: i for i, name in enumerate(self.authors)}
+        self.generation = data.get('generation', 0)
+
+    def _load_removed(self):
+        if os.path.exists(self.removed_path):
+            with open(self.removed_path, 'r', encoding='utf-8') as f:
+                self.removed = json.load(f)
+
+    def _save_removed(self):
+        tmp_path = self.removed_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.removed, f, ensure_ascii=False)
+        os.replace(tmp_path, self.removed_path)
+
+    def _save_dictionary(self):
+        data = {
+            'schema': [{'name': name, 'type': dtype} for name, dtype in SCHEMA],
+            'format': self._extension(),
+            'imagery_separator': IMAGERY_SEPARATOR,
+            'generation': self.generation,
+            'authors': self.authors
+        }
+        tmp_path = self.dictionary_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.dictionary_path)
+
+    def _author_id(self, author):
+        author_id = self.author_ids.get(author)
+        if author_id is None:
+            author_id = len(self.authors)
+            self.author_ids[author] = author_id
+            self.authors.append(author)
+        return author_id
+
+    def is_empty(self):
+        return not self.buffer and not self._part_files()
+
+    def reset(self):
+        """开始新一代导出: 删除已有分块与作废记录(作者编号保留)"""
+        for filepath in self._part_files():
+            os.remove(filepath)
+        if os.path.exists(self.removed_path):
+            os.remove(self.removed_path)
+        self.removed = {}
+        self.buffer = []
+        self.part_index = 0
+        self.generation += 1
+        self._save_dictionary()
+
+    def remove(self, poem_ids):
+        """作废结果: 末块中的行直接丢弃，已写出的完整块中的行由 removed.json 屏蔽"""
+        poem_ids = set(poem_ids)
+        if not poem_ids:
+            return
+        self.buffer = [row for row in self.buffer if row[0] not in poem_ids]
+        for poem_id in poem_ids:
+            self.removed[poem_id] = self.part_index
+        self._save_removed()
+
+    def append(self, records):
+        """追加 AnalysisRecord，满一块即写出并开始下一块"""
+        for record in records:
+            self.buffer.append((record.poem_id, self._author_id(record.author),
+                                int(record.date), record.flower, list(record.imagery)))
+            if len(self.buffer) >= self.chunk_size:
+                self._write_part(self.buffer)
+                self.part_index += 1
+                self.buffer = []
+
+    def flush(self):
+        """检查点: 重写未满的末块(不开始新块)"""
+        if not self.buffer:
+            return None
+        return self._write_part(self.buffer)
+
+    def _write_part(self, rows):
+        filepath = os.path.join(self.output_dir, f'part-{self.part_index:05d}.{self._extension()}')
+        if self.use_parquet:
+            self._write_parquet(filepath, rows)
+        else:
+            self._write_csv(filepath, rows)
+        self._save_dictionary()
+        return filepath
+
+    def _write_parquet(self, filepath, rows):
+        columns = list(zip(*rows))
+        schema = pa.schema([
+            ('poem_id', pa.string()),
+            ('author_id', pa.int32()),
+            ('year', pa.int32()),
+            ('flower', pa.string()),
+            ('imagery', pa.list_(pa.string())),
+        ])
+        table = pa.Table.from_arrays([pa.array(col, type=field.type)
+                                      for col, field in zip(columns, schema)], schema=schema)
+        pq.write_table(table, filepath, row_group_size=self.chunk_size)
+
+    def _write_csv(self, filepath, rows):
+        with open(filepath, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([name for name, _ in SCHEMA])
+            for poem_id, author_id, year, flower, imagery in rows:
+                writer.writerow([poem_id, author_id, year, flower, IMAGERY_SEPARATOR.join(imagery)])
+
+
+def read_columnar(output_dir, columns=None):
+    """按分块读取导出结果，可只读部分列；跳过已作废的旧行"""
+    with open(os.path.join(output_dir, 'dictionary.json'), 'r', encoding='utf-8') as f:
+        dictionary = json.load(f)
+    removed = {}
+    removed_path = os.path.join(output_dir, REMOVED_FILE)
+    if os.path.exists(removed_path):
+        with open(removed_path, 'r', encoding='utf-8') as f:
+            removed = json.load(f)
+    wanted = columns or [name for name, _ in SCHEMA]
+    # 判断是否作废需要 poem_id 列
+    read_columns = wanted if not removed or 'poem_id' in wanted else wanted + ['poem_id']
+
+    for filepath in sorted(glob.glob(os.path.join(output_dir, f"part-*.{dictionary['format']}"))):
+        part_no = int(os.path.basename(filepath).split('.')[0].split('-')[1])
+        if dictionary['format'] == 'parquet':
+            rows = pq.read_table(filepath, columns=read_columns).to_pylist()
+        else:
+            rows = _read_csv_part(filepath, read_columns, dictionary['imagery_separator'])
+        for record in rows:
+            if removed and removed.get(record['poem_id'], -1) > part_no:
+                continue
+            if read_columns is not wanted:
+                del record['poem_id']
+            yield record
+
+
+def _read_csv_part(filepath, columns, separator):
+    with open(filepath, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            record = {}
+            for name in columns:
+                value = row[name]
+                if name in ('author_id', 'year'):
+                    value = int(value)
+                elif name == 'imagery':
+                    value = value.split(separator) if value else []
+                record[name] = value
+            yield record
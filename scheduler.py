@@ -0,0 +1,156 @@
+"""
+预算与截止时间调度
+按预期价值(花卉关键字命中、名篇选集、篇幅短)排序待分析诗词，
+以响应中的真实 usage 统计花费，达到 token/金额预算或截止时间时停止派发，
+剩余队列写入文件以便下次继续
+"""
+
+import heapq
+import json
+import os
+import time
+
+
+PRICE_PER_MILLION_TOKENS = 0.14  # 与 calculate_cost_estimate 一致
+
+PRICE_PER_MILLION_CACHE_HIT_TOKENS = 0.014  # 命中前缀缓存的输入 token
+
+DEFAULT_TOKENS_PER_POEM = 800  # 尚无实际 usage 时的单首估计
+
+FLOWER_KEYWORDS = ['梅', '菊', '莲', '荷', '桃', '杏', '牡丹', '桂', '梨', '海棠',
+                   '兰', '芙蓉', '芍药', '茉莉', '水仙', '蔷薇', '杜鹃', '花']
+
+# 名篇选集
+FAMOUS_COLLECTIONS = {'唐诗三百首.json', '宋词三百首.json', 'shuimotangshi.json'}
+
+
+def token_cost(total_tokens, cache_hit_tokens=0):
+    """按实际 usage 计价: 命中前缀缓存的输入 token 按缓存价，其余按原价"""
+    return ((total_tokens - cache_hit_tokens) * PRICE_PER_MILLION_TOKENS
+            + cache_hit_tokens * PRICE_PER_MILLION_CACHE_HIT_TOKENS) / 1000000
+
+
+def poem_priority(poem):
+    """预期价值评分，越高越先分析"""
+    content = poem.content
+    score = 0.0
+    # 花卉关键字(单字'花'只计一次)
+    score += 2.0 * sum(1 for kw in FLOWER_KEYWORDS[:-1] if kw in content)
+    score += 1.0 if '花' in content else 0.0
+    if poem.source_file in FAMOUS_COLLECTIONS:
+        score += 3.0
+    # 篇幅越短越省 token
+    score += 1.0 - min(len(content), 400) / 400.0
+    return score
+
+
+class BudgetScheduler:
+    """按优先级派发诗词，超出预算或截止时间即停止"""
+
+    def __init__(self, analyzer, budget_tokens=None, budget_money=None, deadline=None):
+        """
+        Args:
+            analyzer: PoetryAnalyzer，读取其 total_tokens 与 cache_hit_tokens 作为实际花费
+            budget_tokens (int): token 预算
+            budget_money (float): 金额预算，命中缓存的 token 按缓存价计(token_cost)
+            deadline (float): 截止时间(秒，从创建调度器起算)
+        """
+        self.analyzer = analyzer
+        self.budget_tokens = budget_tokens
+        self.budget_money = budget_money
+        self.deadline = time.time() + deadline if deadline else None
+
+        self.start_tokens = analyzer.total_tokens
+        self.start_cache_hit_tokens = analyzer.cache_hit_tokens
+        self.heap = []
+        self.seq = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = []
+        self.deferred = []
+        self.stop_reason = None
+
+    def push(self, poems):
+        for poem in poems:
+            heapq.heappush(self.heap, (-poem_priority(poem), self.seq, poem))
+            self.seq += 1
+
+    def spent_tokens(self):
+        return self.analyzer.total_tokens - self.start_tokens
+
+    def spent_money(self):
+        return token_cost(self.spent_tokens(), self.analyzer.cache_hit_tokens - self.start_cache_hit_tokens)
+
+    def tokens_per_poem(self):
+        if self.completed == 0 or self.spent_tokens() == 0:
+            return DEFAULT_TOKENS_PER_POEM
+        return self.spent_tokens() / self.completed
+
+    def money_per_poem(self):
+        if self.completed == 0 or self.spent_tokens() == 0:
+            return token_cost(DEFAULT_TOKENS_PER_POEM)
+        return self.spent_money() / self.completed
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.heap:
+            self.stop_reason = self.stop_reason or '队列已空'
+            raise StopIteration
+        if self.deadline and time.time() >= self.deadline:
+            self.stop_reason = '到达截止时间'
+            raise StopIteration
+        if self.budget_tokens is not None:
+            # 已花费 + 在途请求 + 下一首的预计花费不得超过预算
+            projected = self.spent_tokens() + (self.in_flight + 1) * self.tokens_per_poem()
+            if projected > self.budget_tokens:
+                self.stop_reason = '达到预算'
+                raise StopIteration
+        if self.budget_money is not None:
+            projected = self.spent_money() + (self.in_flight + 1) * self.money_per_poem()
+            if projected > self.budget_money:
+                self.stop_reason = '达到预算'
+                raise StopIteration
+
+        self.in_flight += 1
+        return heapq.heappop(self.heap)[2]
+
+    def done(self, poem, success):
+        """一首诗分析结束(成功或失败)"""
+        self.in_flight -= 1
+        self.completed += 1
+        if not success:
+            self.failed.append(poem)
+
+    def defer(self, poems):
+        """不经派发直接写入剩余队列的诗词(如代表失败或未派发的同文诗词)"""
+        self.deferred.extend(poems)
+
+    def pending_ids(self):
+        """剩余队列(按优先级) + 本次失败的诗词 + 随之延后的诗词"""
+        return ([item[2].poem_id for item in sorted(self.heap)] + [p.poem_id for p in self.failed]
+                + [p.poem_id for p in self.deferred])
+
+    def save_queue(self, path):
+        """写出剩余队列，下次用 --resume-queue 继续"""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        pending = self.pending_ids()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'stop_reason': self.stop_reason, 'pending': pending}, f, ensure_ascii=False)
+        return len(pending)
+
+    def report(self):
+        spent = self.spent_tokens()
+        cost = self.spent_money()
+        print(f"调度结束: {self.stop_reason} | 已完成 {self.completed} 首 | "
+              f"实际消耗 {spent:,} tokens (约 {cost:.4f}) | 剩余 {len(self.heap)} 首, 失败 {len(self.failed)} 首"
+              f"{f', 同文延后 {len(self.deferred)} 首' if self.deferred else ''}")
+
+
+def load_queue(path):
+    """读取上次保存的剩余队列，返回 poem_id 列表"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['pending']
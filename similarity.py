@@ -0,0 +1,195 @@
+"""
+相似诗词检索
+基于 DataLoader 输出，字符二元组 TF-IDF 稀疏向量(NumPy CSR)，分块计算余弦相似度取 top-k；
+矩阵保存为 .npz，再次使用时直接加载
+"""
+
+import os
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+
+
+_PUNCTUATION = re.compile(r'[\W_]+')
+
+INDEX_PATH = os.path.join('analysis_output', 'similarity_index.npz')
+
+
+def char_bigrams(text):
+    """去标点后的字符二元组(按句切分，不跨标点)"""
+    grams = []
+    for segment in _PUNCTUATION.split(text):
+        grams.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+class SimilarityIndex:
+    """TF-IDF 相似度索引"""
+
+    def __init__(self):
+        self.vocab = {}  # 二元组 -> 列号
+        self.idf = None
+        self.poem_ids = []
+        self.id_rows = {}
+        self.indptr = None
+        self.indices = None
+        self.data = None
+        self.row_ids = None  # 每个非零元素所在的行
+
+    def build(self, poems):
+        """由 PoemRecord 列表建立索引"""
+        vocab = self.vocab
+        indptr = [0]
+        indices = []
+        counts = []
+        for poem in poems:
+            tf = Counter(vocab.setdefault(g, len(vocab)) for g in char_bigrams(poem.content))
+            indices.extend(tf.keys())
+            counts.extend(tf.values())
+            indptr.append(len(indices))
+
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        tf = np.asarray(counts, dtype=np.float32)
+
+        n_docs = len(poems)
+        df = np.bincount(self.indices, minlength=len(vocab)).astype(np.float32)
+        self.idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+        self.data = (1.0 + np.log(tf)) * self.idf[self.indices]
+        self._finish([p.poem_id for p in poems])
+
+        print(f"相似度索引: {n_docs} 首诗词, {len(vocab)} 个二元组, {len(self.indices)} 个非零元素")
+        return self
+
+    def _finish(self, poem_ids):
+        """行归一化并建立辅助数组"""
+        self.poem_ids = poem_ids
+        self.id_rows = {pid: i for i, pid in enumerate(poem_ids)}
+        lengths = np.diff(self.indptr)
+        self.row_ids = np.repeat(np.arange(len(poem_ids), dtype=np.int32), lengths)
+        norms = np.sqrt(np.bincount(self.row_ids, weights=self.data * self.data,
+                                    minlength=len(poem_ids))).astype(np.float32)
+        norms[norms == 0] = 1.0
+        self.data = self.data / norms[self.row_ids]
+
+    def _query_vector(self, text):
+        """查询文本 -> 稠密向量(长度为词表大小)"""
+        q = np.zeros(len(self.vocab), dtype=np.float32)
+        tf = Counter(self.vocab[g] for g in char_bigrams(text) if g in self.vocab)
+        if not tf:
+            return None
+        cols = np.fromiter(tf.keys(), dtype=np.int64, count=len(tf))
+        q[cols] = (1.0 + np.log(np.fromiter(tf.values(), dtype=np.float32, count=len(tf)))) * self.idf[cols]
+        q /= np.sqrt((q[cols] ** 2).sum())
+        return q
+
+    def _row_vector(self, row):
+        q = np.zeros(len(self.vocab), dtype=np.float32)
+        lo, hi = self.indptr[row], self.indptr[row + 1]
+        q[self.indices[lo:hi]] = self.data[lo:hi]
+        return q
+
+    def _top_k(self, q, k, exclude=None, mask=None, block_rows=65536):
+        """分块计算余弦相似度，合并各块的 top-k"""
+        n_rows = len(self.poem_ids)
+        best_rows = []
+        best_scores = []
+        for start in range(0, n_rows, block_rows):
+            stop = min(start + block_rows, n_rows)
+            lo, hi = self.indptr[start], self.indptr[stop]
+            scores = np.bincount(self.row_ids[lo:hi] - start,
+                                 weights=q[self.indices[lo:hi]] * self.data[lo:hi],
+                                 minlength=stop - start)
+            if mask is not None:
+                scores[~mask[start:stop]] = -1.0
+            if exclude is not None and start <= exclude < stop:
+                scores[exclude - start] = -1.0
+
+            top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(-scores)[:k]
+        return [(self.poem_ids[rows[i]], float(scores[i])) for i in order if scores[i] > 0]
+
+    def query(self, text, k=10, candidates=None):
+        """
+        与给定文本最相似的 k 首诗词
+        Args:
+            candidates (set): 只在这些 poem_id 中检索(如同为梅花的诗)
+        Returns:
+            [(poem_id, 相似度), ...]
+        """
+        q = self._query_vector(text)
+        if q is None:
+            return []
+        return self._top_k(q, k, mask=self._mask(candidates))
+
+    def similar_to(self, poem_id, k=10, candidates=None):
+        """与索引中某首诗最相似的 k 首(不含自身)"""
+        row = self.id_rows[poem_id]
+        return self._top_k(self._row_vector(row), k, exclude=row, mask=self._mask(candidates))
+
+    def _mask(self, candidates):
+        if candidates is None:
+            return None
+        mask = np.zeros(len(self.poem_ids), dtype=bool)
+        mask[[self.id_rows[pid] for pid in candidates if pid in self.id_rows]] = True
+        return mask
+
+    def save(self, path=INDEX_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        terms = sorted(self.vocab, key=self.vocab.get)
+        np.savez(path, indptr=self.indptr, indices=self.indices, data=self.data, idf=self.idf,
+                 terms=np.array(terms), poem_ids=np.array(self.poem_ids))
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        arrays = np.load(path)
+        index = cls()
+        index.vocab = {term: i for i, term in enumerate(arrays['terms'].tolist())}
+        index.idf = arrays['idf']
+        index.indptr = arrays['indptr']
+        index.indices = arrays['indices']
+        index.poem_ids = arrays['poem_ids'].tolist()
+        index.id_rows = {pid: i for i, pid in enumerate(index.poem_ids)}
+        index.data = arrays['data']
+        index.row_ids = np.repeat(np.arange(len(index.poem_ids), dtype=np.int32), np.diff(index.indptr))
+        return index
+
+
+def main():
+    """python similarity.py <poem_id 或 诗句> [k]"""
+    import time
+    from json_poem_analyzer import DataLoader
+
+    if len(sys.argv) < 2:
+        print(main.__doc__)
+        return
+
+    if os.path.exists(INDEX_PATH):
+        index = SimilarityIndex.load(INDEX_PATH)
+    else:
+        index = SimilarityIndex().build(DataLoader('data').load_poems(mode='full'))
+        index.save(INDEX_PATH)
+
+    target = sys.argv[1]
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    start = time.time()
+    if target in index.id_rows:
+        results = index.similar_to(target, k)
+    else:
+        results = index.query(target, k)
+    print(f"检索用时 {(time.time() - start) * 1000:.0f} ms")
+    for poem_id, score in results:
+        print(f"  {score:.3f}  {poem_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+分阶段计时与性能剖析
+load -> prompt -> request -> parse -> standardize -> checkpoint 各阶段累计次数与耗时，
+运行结束时输出分阶段统计；可选 cProfile 或采样剖析(覆盖所有工作线程)写出到输出目录
+"""
+
+import cProfile
+import functools
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """线程安全的阶段计时器"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}  # 阶段 -> [次数, 总耗时, 最大耗时]
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                entry = self.stats.get(name)
+                if entry is None:
+                    self.stats[name] = [1, elapsed, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    if elapsed > entry[2]:
+                        entry[2] = elapsed
+
+    def timed(self, name):
+        """方法装饰器"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.started = time.perf_counter()
+
+    def report(self):
+        """输出分阶段统计(并发时各阶段耗时之和可超过总用时)"""
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda kv: kv[1][1], reverse=True)
+        wall = time.perf_counter() - self.started
+        print(f"\n分阶段耗时 (总用时 {wall:.1f}s):")
+        print(f"  {'阶段':<12}{'次数':>8}{'总耗时(s)':>12}{'平均(ms)':>12}{'最大(ms)':>12}")
+        for name, (count, total, longest) in stats:
+            print(f"  {name:<12}{count:>8}{total:>12.2f}{total / count * 1000:>12.1f}{longest * 1000:>12.1f}")
+
+
+STAGE_TIMER = StageTimer()
+timed = STAGE_TIMER.timed
+
+
+class SamplingProfiler:
+    """定时采样所有线程的调用栈，输出 flamegraph 折叠格式"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiled(mode, path_prefix):
+    """
+    Args:
+        mode: None / 'cprofile'(仅主线程) / 'sample'(所有线程)
+        path_prefix: 输出文件路径前缀
+    """
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path_prefix + '.prof')
+            print(f"cProfile 结果已保存到: {path_prefix}.prof")
+    elif mode == 'sample':
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.dump(path_prefix + '.folded')
+            print(f"采样剖析结果已保存到: {path_prefix}.folded")
+    else:
+        yield